@@ -5,6 +5,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+ASGI serving mode: with ASYNC_VIEWS=1 the read only interval and metric routes are served by the async views of
+api/async_views.py, so a worker keeps many slow polling clients waiting on its event loop instead of holding a
+thread for each of them. Run it with uvicorn instead of the WSGI gunicorn command of the Procfile, e.g.
+
+    ASYNC_VIEWS=1 uvicorn Backend.asgi:application --host 0.0.0.0 --port $PORT --workers 2
+
+or keep gunicorn as the process manager with uvicorn workers:
+
+    ASYNC_VIEWS=1 gunicorn Backend.asgi:application -k uvicorn.workers.UvicornWorker
+
+The other routes stay synchronous. Under ASGI Django runs synchronous views one at a time per worker process,
+so writes scale with the number of workers.
 """
 
 import os
@@ -14,3 +27,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Backend.settings')
 
 application = get_asgi_application()
+
+from api.scheduler import start_from_settings  # pylint: disable=wrong-import-position
+
+start_from_settings()
@@ -2,6 +2,8 @@ from pathlib import Path
 import sys
 import os
 
+import dj_database_url
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -33,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.routers.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -88,6 +92,51 @@ DATABASES = {
 if 'test' in sys.argv:
     DATABASES['default'] = DATABASES['test']
 
+# A local database for development and benchmarks, e.g. sqlite:///db.sqlite3 or postgres://user@localhost/contribute
+if os.getenv('LOCAL_DATABASE_URL'):
+    DATABASES['default'] = dj_database_url.parse(os.getenv('LOCAL_DATABASE_URL'))
+
+# Read replica
+# With REPLICA_DATABASE_URL set, the read only views marked with api.routers.replica_reads read from it, see
+# api/routers.py. Two local databases work too, e.g. LOCAL_DATABASE_URL=sqlite:///db.sqlite3 and
+# REPLICA_DATABASE_URL=sqlite:///replica.sqlite3 holding a copy of it. Tests read the replica from default.
+if os.getenv('REPLICA_DATABASE_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.getenv('REPLICA_DATABASE_URL'))
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+REPLICA_DATABASE_ALIAS = 'replica' if 'replica' in DATABASES else None
+# Seconds a client that wrote reads from default, covering the replication lag
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+DATABASE_ROUTERS = ['api.routers.ReadReplicaRouter']
+
+# Seconds a connection is kept open for the next request or async view query on the same thread, 0 to close it
+DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', '60'))
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
+
+
+# Interval rollover
+# Intervals are created ahead of time by the clock process of the Procfile, `python manage.py run_interval_scheduler`,
+# by `python manage.py create_intervals` (e.g. from cron), or by a scheduler thread in each web server process on
+# deployments that set INTERVAL_SCHEDULER=1.
+
+INTERVAL_SCHEDULER_ENABLED = os.getenv('INTERVAL_SCHEDULER') == '1'
+INTERVAL_SCHEDULER_PERIOD = int(os.getenv('INTERVAL_SCHEDULER_PERIOD', '60'))
+INTERVAL_ROLLOVER_AHEAD_DAYS = int(os.getenv('INTERVAL_ROLLOVER_AHEAD_DAYS', '0'))
+
+
+# Server metrics
+# /api/metrics/server answers admin users and, when METRICS_TOKEN is set, requests sending
+# `Authorization: Bearer <METRICS_TOKEN>` such as a Prometheus scraper.
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+# Async views
+# Serves the read only interval and metric routes with the views of api/async_views.py, for deployments running
+# over ASGI as described in Backend/asgi.py.
+
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
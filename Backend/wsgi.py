@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Backend.settings')
 
 application = get_wsgi_application()
+
+from api.scheduler import start_from_settings  # pylint: disable=wrong-import-position
+
+start_from_settings()
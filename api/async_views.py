@@ -0,0 +1,223 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+
+from api.helpers import (
+    get_average_incomes, get_average_window, get_income_per_source, get_income_unsubmitted_users,
+    get_intervals_per_period, get_interval_income_sums, get_interval_payment_sums, get_tax_version,
+    get_user_income_totals, get_user_payment_totals
+)
+from api.models import Interval, Payment, User
+from api.routers import replica_reads
+from api.versions import versions_etag
+from api.views import build_dashboard, get_interval_totals, list_intervals, parse_date_range
+
+'''
+Async versions of the read only interval and metric views, used when the ASYNC_VIEWS setting is on and the app is
+served over ASGI (see Backend/asgi.py). The ORM is synchronous, so queries run in worker threads: a slow query holds a
+thread, but a client waiting on a slow response only holds the event loop. A response is loaded with one thread hop,
+its ETag check included; only the heavy independent aggregations of the dashboard run concurrently. Worker threads
+keep their database connection for CONN_MAX_AGE, like the threads of the sync server.
+'''
+
+
+def in_own_connection(func):
+    """ Wraps an ORM call made from a worker thread to close its connection if expired or broken, as after a request """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return inner
+
+
+async def run_in_thread(func, *args):
+    """ Runs func(*args) in a worker thread """
+    return await sync_to_async(in_own_connection(func), thread_sensitive=False)(*args)
+
+
+async def run_concurrently(*calls):
+    """ Runs (function, *args) calls at the same time in worker threads, returning their results in order """
+    return await asyncio.gather(*[run_in_thread(func, *args) for func, *args in calls])
+
+
+def respond(request, keys, load, *args):
+    """ Answers 304 when the request matches the ETag of the versions of keys, else the response of load(*args) """
+    etag = quote_etag(versions_etag(*keys)(request))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = load(*args)
+        response.setdefault('ETag', etag)
+    return response
+
+
+def require_safe(view):
+    """ Async counterpart of django.views.decorators.http.require_safe, answering other methods like DRF does """
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = JsonResponse({'detail': 'Method "%s" not allowed.' % request.method},
+                                    status=status.HTTP_405_METHOD_NOT_ALLOWED)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+def bad_request(message):
+    return JsonResponse({'message': message}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def not_found():
+    return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+
+def get_interval(interval_id):
+    return Interval.objects.filter(pk=interval_id).first()
+
+
+def get_intervals():
+    return list(Interval.objects.all())
+
+
+def get_user_ids():
+    return list(User.objects.values_list('id', flat=True))
+
+
+def load_interval_list(params):
+    try:
+        return JsonResponse(list_intervals(params), safe=False)
+    except ValueError as e:
+        return bad_request(str(e))
+
+
+def load_payments(interval_id):
+    return JsonResponse(dict(Payment.objects.filter(interval_id=interval_id).values_list('user_id', 'amount')))
+
+
+def load_income_per_interval(interval_id):
+    if get_interval(interval_id) is None:
+        return not_found()
+    return JsonResponse(get_income_per_source(interval_id))
+
+
+def load_avg_income_per_interval(interval_id):
+    c_i = get_interval(interval_id)
+    if c_i is None:
+        return not_found()
+    avg_incs = get_average_incomes(c_i.id, get_intervals_per_period())
+    return JsonResponse({inc['user']: inc['amount'] for inc in avg_incs})
+
+
+def load_unsubmitted_users(interval_id):
+    return JsonResponse(sorted(get_income_unsubmitted_users(interval_id)), safe=False)
+
+
+def load_dashboard_inputs(interval_id):
+    """ The interval, the params, the averaging window, the tax version and then the ids of every user """
+    c_i = get_interval(interval_id)
+    if c_i is None:
+        return None
+    intervals_per_period = get_intervals_per_period()
+    window = get_average_window(c_i, intervals_per_period)
+    version = get_tax_version(c_i, window[:intervals_per_period])
+    return c_i, intervals_per_period, window, version, get_user_ids()
+
+
+def load_user_totals(get_totals, from_date, to_date):
+    return JsonResponse(get_totals(from_date, to_date))
+
+
+def load_interval_totals(get_sums):
+    return JsonResponse(get_interval_totals(get_intervals(), get_sums()))
+
+
+@replica_reads
+@require_safe
+async def interval_list(request):
+    return await run_in_thread(respond, request, ['intervals'], load_interval_list, request.GET)
+
+
+# Specified by interval
+
+@replica_reads
+@require_safe
+async def payment(request, interval):
+    return await run_in_thread(respond, request, ['payments'], load_payments, interval)
+
+
+@replica_reads
+@require_safe
+async def income_per_interval(request, interval):
+    return await run_in_thread(load_income_per_interval, interval)
+
+
+@replica_reads
+@require_safe
+async def avg_income_per_interval(request, interval):
+    return await run_in_thread(load_avg_income_per_interval, interval)
+
+
+@replica_reads
+@require_safe
+async def unsubmitted_users_per_interval(request, interval):
+    return await run_in_thread(load_unsubmitted_users, interval)
+
+
+@require_safe
+async def interval_dashboard(request, interval):
+    """ GET the interval dashboard, loading its incomes per source and its averaged incomes concurrently """
+    inputs = await run_in_thread(load_dashboard_inputs, interval)
+    if inputs is None:
+        return not_found()
+    c_i, intervals_per_period, window, version, user_ids = inputs
+    income_per_source, avg_incs = await run_concurrently(
+        (get_income_per_source, c_i.id), (get_average_incomes, c_i.id, intervals_per_period, window))
+    dashboard = await run_in_thread(
+        build_dashboard, c_i, intervals_per_period, window, version, income_per_source, user_ids, avg_incs)
+    return JsonResponse(dashboard)
+
+
+# Metrics
+
+@replica_reads
+@require_safe
+async def total_income(request):
+    try:
+        from_date, to_date = parse_date_range(request.GET)
+    except ValueError:
+        return bad_request('Dates must be formatted as YYYY-MM-DD.')
+    return await run_in_thread(
+        respond, request, ['incomes', 'users'], load_user_totals, get_user_income_totals, from_date, to_date)
+
+
+@replica_reads
+@require_safe
+async def total_paid(request):
+    try:
+        from_date, to_date = parse_date_range(request.GET)
+    except ValueError:
+        return bad_request('Dates must be formatted as YYYY-MM-DD.')
+    return await run_in_thread(
+        respond, request, ['payments', 'users'], load_user_totals, get_user_payment_totals, from_date, to_date)
+
+
+@replica_reads
+@require_safe
+async def total_income_by_interval(request):
+    return await run_in_thread(respond, request, ['incomes', 'intervals'], load_interval_totals,
+                               get_interval_income_sums)
+
+
+@replica_reads
+@require_safe
+async def total_payment_by_interval(request):
+    return await run_in_thread(respond, request, ['payments', 'intervals'], load_interval_totals,
+                               get_interval_payment_sums)
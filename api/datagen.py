@@ -0,0 +1,97 @@
+import random
+from datetime import date, timedelta
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from api.helpers import recompute_all_payments
+from api.interval_index import interval_index
+from api.intervals import DAYS_IN_INTERVAL
+from api.models import (
+    User, IncomeSource, Interval, Income, Payment, IncomeRollup, IncomePrefix, TaxResult
+)
+from api.rollup import rebuild_income_rollup
+from api.versions import bump_versions
+
+BATCH_SIZE = 1000
+USER_ID_PREFIX = 'SYN'
+USER_ID_DIGITS = User._meta.get_field('id').max_length - len(USER_ID_PREFIX)
+MAX_USERS = 10 ** USER_ID_DIGITS - 1
+SOURCE_NAMES = ['Salary', 'Freelance', 'Rent', 'Dividends', 'Shop', 'Tutoring', 'Overtime', 'Bonus']
+
+
+def clear_data():
+    """ Deletes every user, income, interval and payment, and the tables derived from them, without signals """
+    tables = [model._meta.db_table
+              for model in [IncomeRollup, IncomePrefix, TaxResult, Payment, Income, Interval, IncomeSource, User]]
+    connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables))
+    interval_index.invalidate()
+    bump_versions('incomes', 'income:all', 'payments', 'intervals', 'users')
+
+
+'''
+Fills the database with a reproducible synthetic dataset: users with a few income sources each and back to back
+intervals, the last one containing end_date. Every user has incomes_per_interval incomes in each interval except
+the last one, which only about half of the users have submitted yet, like a live interval.
+Each user earns around a base amount picked from a long tailed distribution, so taxes are spread unevenly.
+Input: generate_dataset(users=3, sources_per_user=2, intervals=4, incomes_per_interval=2)
+Output: e.g {'users': 3, 'income_sources': 6, 'intervals': 4, 'incomes': 20, 'payments': 9}
+'''
+
+
+def generate_dataset(users, sources_per_user, intervals, incomes_per_interval, seed=0, end_date=None,
+                     interval_amount=1100, payments=True):
+    if not 0 < users <= MAX_USERS:
+        raise ValueError('Between 1 and %d users can be generated.' % MAX_USERS)
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+
+    with transaction.atomic():
+        user_objs = [User(id='%s%0*d' % (USER_ID_PREFIX, USER_ID_DIGITS, u_i), name='Synthetic user %d' % u_i)
+                     for u_i in range(1, users + 1)]
+        User.objects.bulk_create(user_objs, batch_size=BATCH_SIZE)
+
+        IncomeSource.objects.bulk_create([
+            IncomeSource(user_id=u_o.id, name=SOURCE_NAMES[s_i] if s_i < len(SOURCE_NAMES) else 'Source %d' % (s_i + 1))
+            for u_o in user_objs for s_i in range(sources_per_user)], batch_size=BATCH_SIZE)
+        sources = {}
+        for source_id, user_id in IncomeSource.objects.filter(user__in=user_objs).values_list('id', 'user'):
+            sources.setdefault(user_id, []).append(source_id)
+
+        first_start = end_date - timedelta(days=intervals * DAYS_IN_INTERVAL - 1)
+        Interval.objects.bulk_create([
+            Interval(start_date=first_start + timedelta(days=i_i * DAYS_IN_INTERVAL),
+                     end_date=first_start + timedelta(days=(i_i + 1) * DAYS_IN_INTERVAL - 1), amount=interval_amount)
+            for i_i in range(intervals)], batch_size=BATCH_SIZE)
+        # Not every backend returns the ids of bulk inserted rows
+        interval_objs = list(Interval.objects.filter(start_date__gte=first_start).order_by('start_date'))
+        interval_index.invalidate()
+
+        base_amounts = {u_o.id: int(rng.lognormvariate(7, 0.6)) for u_o in user_objs}
+        incomes = []
+        income_count = 0
+        for i_pos, i_o in enumerate(interval_objs):
+            live = i_pos == len(interval_objs) - 1
+            for u_o in user_objs:
+                if live and rng.random() < 0.5:
+                    continue
+                for _ in range(incomes_per_interval):
+                    incomes.append(Income(
+                        incomesource_id=rng.choice(sources[u_o.id]),
+                        amount=max(1, int(base_amounts[u_o.id] / incomes_per_interval * rng.uniform(0.5, 1.5))),
+                        date=i_o.start_date + timedelta(days=rng.randrange(DAYS_IN_INTERVAL)),
+                        interval_id=i_o.id))
+            if len(incomes) >= BATCH_SIZE:
+                Income.objects.bulk_create(incomes, batch_size=BATCH_SIZE)
+                income_count += len(incomes)
+                incomes = []
+        Income.objects.bulk_create(incomes, batch_size=BATCH_SIZE)
+        income_count += len(incomes)
+
+        # Bulk inserts skip the signals maintaining the derived tables
+        rebuild_income_rollup()
+        bump_versions('users', 'intervals')
+        payment_count = recompute_all_payments()['payments_created'] if payments else 0
+
+    return {'users': len(user_objs), 'income_sources': sum(len(s) for s in sources.values()),
+            'intervals': len(interval_objs), 'incomes': income_count, 'payments': payment_count}
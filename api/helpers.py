@@ -1,6 +1,15 @@
-from django.db.models import Sum, F
-from api.models import Income, Interval, User, Payment
+import logging
+from collections import Counter, deque
+from hashlib import sha1
 
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Sum
+from api.models import Income, IncomePrefix, IncomeRollup, Interval, User, Payment, NumericalParams, TaxResult
+from api.versions import bump_versions, get_versions, income_version_key
+
+logger = logging.getLogger(__name__)
+
+# Default of the 'intervals_per_period' numerical param
 INTERVALS_PER_PERIOD = 2
 DEGREE_POLY = 1
 '''
@@ -10,74 +19,302 @@ Output: Tax per user e.g {'MAL001': 296, 'SRI001': 337, 'ANU001': 72, 'MAI001':
 '''
 
 
-def apply_tax(user_dict, total_tax):
+def apply_tax(user_dict, total_tax, degree=DEGREE_POLY):
     income_list = list(user_dict.values())
 
     try:
         div_amount = total_tax / \
-            sum([income**(DEGREE_POLY + 1) for income in income_list])
+            sum([income**(degree + 1) for income in income_list])
     except ZeroDivisionError:  # Triggered if all income is 0.
         return {user_name: 0 for user_name in user_dict.keys()}
 
     tax_dict = {}
     for user_name, user_income in user_dict.items():
         tax_dict[user_name] = round(
-            div_amount * user_income ** (DEGREE_POLY + 1))
+            div_amount * user_income ** (degree + 1))
 
     return tax_dict
 
 
-def get_average_incomes(interval_id):
-    c_i = Interval.objects.filter(id=interval_id).first()
-    avg_i = Interval.objects.filter(end_date__lte=c_i.end_date).order_by(
-        '-start_date')[:INTERVALS_PER_PERIOD]
-    sd = avg_i[len(avg_i) - 1].start_date
-    ed = avg_i[0].end_date
+def div_towards_zero(a, b):
+    """ Integer division truncating like the database does, rather than flooring """
+    return a // b if a >= 0 else -(-a // b)
+
+
+def get_numerical_param(key, default):
+    value = NumericalParams.objects.filter(pk=key).values_list('value', flat=True).first()
+    return default if value is None else value
+
+
+def get_intervals_per_period():
+    # Averages divide by it, so a value stored before it was validated counts as a single interval
+    return max(get_numerical_param('intervals_per_period', INTERVALS_PER_PERIOD), 1)
+
+
+def get_average_window(c_i, intervals_per_period):
+    """ Ids of the intervals averaged for c_i, latest first, followed by the one just before them if any """
+    window = Interval.objects.filter(end_date__lte=c_i.end_date).order_by(
+        '-start_date').values_list('id', flat=True)[:intervals_per_period + 1]
+    return list(window)
+
+
+def get_average_interval_ids(c_i, intervals_per_period=None):
+    if intervals_per_period is None:
+        intervals_per_period = get_intervals_per_period()
+    return get_average_window(c_i, intervals_per_period)[:intervals_per_period]
 
-    incs = Income.objects.filter(date__gte=sd, date__lte=ed)
-    avg_incs = incs.values('incomesource__user').annotate(
-        user=F('incomesource__user'),
-        amount=(
-            Sum('amount') /
-            INTERVALS_PER_PERIOD)).values(
-        'user',
-        'amount')
-    return avg_incs
 
+'''
+Averages each user's income over the intervals_per_period intervals ending with the given one, as the difference
+of the running totals at the given interval and at the interval just before the window.
+Output: Average per user with income in the window e.g [{'user': 'MAL001', 'amount': 750}]
+'''
+
+
+def get_average_incomes(interval_id, intervals_per_period=None, window=None):
+    if intervals_per_period is None:
+        intervals_per_period = get_intervals_per_period()
+    if window is None:
+        window = get_average_window(Interval.objects.get(id=interval_id), intervals_per_period)
+    prev_i = window[intervals_per_period:intervals_per_period + 1]
+
+    prefixes = IncomePrefix.objects.filter(interval__in=[interval_id, *prev_i]).values_list(
+        'interval', 'user', 'amount_total', 'income_count')
+    totals = {}
+    for p_interval, user, amount_total, income_count in prefixes:
+        sign = 1 if p_interval == int(interval_id) else -1
+        total = totals.setdefault(user, [0, 0])
+        total[0] += sign * amount_total
+        total[1] += sign * income_count
 
-def get_tax_dict(interval_id):
-    avg_incs = get_average_incomes(interval_id)
+    return [{'user': user, 'amount': div_towards_zero(amount, intervals_per_period)}
+            for user, (amount, count) in totals.items() if count > 0]
+
+
+def get_tax_dict(interval_id, intervals_per_period=None, total_tax=None, avg_incs=None):
+    if avg_incs is None:
+        avg_incs = get_average_incomes(interval_id, intervals_per_period)
     amount_arr = [inc['amount'] for inc in avg_incs]
     user_arr = [inc['user'] for inc in avg_incs]
     income_dict = dict(zip(user_arr, amount_arr))
 
-    total_tax = Interval.objects.get(id=interval_id).amount
+    if total_tax is None:
+        total_tax = Interval.objects.get(id=interval_id).amount
     return apply_tax(income_dict, total_tax)
 
 
-def get_income_unsubmitted_users(interval_id):
-    c_i = Interval.objects.filter(id=interval_id).first()
-    sd, ed = c_i.start_date, c_i.end_date
-    incs = Income.objects.filter(date__gte=sd, date__lte=ed)
+'''
+Version of everything the tax of an interval depends on: its amount, the incomes of its averaging window,
+the numerical params and the set of users.
+'''
 
-    income_submitted_users = set([user['incomesource__user'] for user in incs.values('incomesource__user')])
-    all_users = set([user.id for user in User.objects.all()])
-    income_unsubmitted_users = all_users - income_submitted_users
 
-    return income_unsubmitted_users, income_submitted_users
+def get_tax_version(c_i, avg_interval_ids):
+    keys = [income_version_key(i_id) for i_id in avg_interval_ids] + ['income:all', 'numerical_params', 'users']
+    version = [c_i.amount, avg_interval_ids, get_versions(keys)]
+    return sha1(repr(version).encode('utf-8')).hexdigest()
+
+
+'''
+Returns whether all income was submitted and the tax of an interval, recomputing and submitting it as payments
+only when its version changed since the last call. Callers that already loaded the averaging window, the
+averaged incomes or the unsubmitted users of the interval can pass them in to skip their queries, along with the
+version from get_tax_version read before loading them, so a result is never stored under a newer version than
+its inputs.
+Output: e.g (True, {'MAL001': 296, 'SRI001': 337})
+'''
+
+
+def get_tax_result(c_i, intervals_per_period=None, window=None, avg_incs=None, unsubmitted_users=None, version=None):
+    if intervals_per_period is None:
+        intervals_per_period = get_intervals_per_period()
+    if window is None:
+        window = get_average_window(c_i, intervals_per_period)
+    if version is None:
+        version = get_tax_version(c_i, window[:intervals_per_period])
+    cached = TaxResult.objects.filter(interval=c_i, version=version).first()
+    if cached is not None:
+        return cached.all_income_submitted, cached.tax
+
+    if unsubmitted_users is None:
+        all_income_submitted = has_all_income_submitted(c_i.id)
+    else:
+        all_income_submitted = not unsubmitted_users
+    tax_dict = {}
+    if all_income_submitted:
+        if avg_incs is None:
+            avg_incs = get_average_incomes(c_i.id, intervals_per_period, window)
+        tax_dict = get_tax_dict(c_i.id, intervals_per_period, c_i.amount, avg_incs)
+    submit_income_as_payment(c_i.id, tax_dict, all_income_submitted)
+
+    TaxResult.objects.update_or_create(interval=c_i, defaults={
+        'version': version, 'all_income_submitted': all_income_submitted, 'tax': tax_dict})
+    return all_income_submitted, tax_dict
+
+
+def get_income_unsubmitted_users_query(interval_id):
+    """ Users without any income in the interval, as a NOT EXISTS anti-join against the rollup """
+    submitted = IncomeRollup.objects.filter(interval_id=interval_id, user=OuterRef('pk'))
+    return User.objects.filter(~Exists(submitted))
+
+
+def get_income_unsubmitted_users(interval_id):
+    return set(get_income_unsubmitted_users_query(interval_id).values_list('id', flat=True))
 
 
 def has_all_income_submitted(interval_id):
-    income_unsubmitted_users, _ = get_income_unsubmitted_users(interval_id)
-    if len(income_unsubmitted_users) > 0:
-        return False
-    return True
+    return not get_income_unsubmitted_users_query(interval_id).exists()
+
+
+def get_income_per_source(interval):
+    incs = Income.objects.filter(interval=interval).order_by(
+        'incomesource__user', 'incomesource', 'id').values_list('id', 'amount', 'incomesource__user', 'incomesource__name')
+
+    income_dict = {}
+    for inc_id, amount, user_id, source_name in incs:
+        source = income_dict.setdefault(user_id, {}).setdefault(source_name, {'amount': 0, 'ids': []})
+        source['amount'] += amount
+        source['ids'].append(inc_id)
+    return income_dict
+
+
+def get_interval_income_sums():
+    """ Income per interval id, for the intervals with any income """
+    return dict(IncomeRollup.objects.values_list('interval').annotate(Sum('amount_sum')).order_by())
+
+
+def get_interval_payment_sums():
+    """ Payments per interval id, for the intervals with any payment """
+    return dict(Payment.objects.values_list('interval').annotate(Sum('amount')).order_by())
+
+
+def get_income_by_interval(intervals):
+    incs = get_interval_income_sums()
+    return {i_o.id: incs.get(i_o.id, 0) for i_o in intervals}
+
+
+def get_payment_by_interval(intervals):
+    pays = get_interval_payment_sums()
+    return {i_o.id: pays.get(i_o.id, 0) for i_o in intervals}
+
+
+'''
+Sums a related amount per user in one grouped query, optionally within a date window.
+Users without any matching rows are returned with None.
+Input: Path to the amount from User, the date fields bounding each row, and the window e.g
+    ('payment__amount', 'payment__interval__start_date', 'payment__interval__end_date', date(2021, 1, 1), None)
+Output: Total per user e.g {'MAL0001': 1200, 'SRI0001': None}
+'''
+
+
+def get_user_totals(amount_field, start_field, end_field, from_date=None, to_date=None):
+    date_filter = Q()
+    if from_date is not None:
+        date_filter &= Q(**{start_field + '__gte': from_date})
+    if to_date is not None:
+        date_filter &= Q(**{end_field + '__lte': to_date})
+
+    totals = User.objects.annotate(total=Sum(amount_field, filter=date_filter)).values_list('id', 'total')
+    return dict(totals)
+
+
+def get_user_income_totals(from_date=None, to_date=None):
+    return get_user_totals('incomesource__income__amount', 'incomesource__income__date',
+                           'incomesource__income__date', from_date, to_date)
+
+
+def get_user_payment_totals(from_date=None, to_date=None):
+    return get_user_totals('payment__amount', 'payment__interval__start_date',
+                           'payment__interval__end_date', from_date, to_date)
+
+
+'''
+Writes the tax of an interval as its payments, touching only the rows that differ.
+Output: Rows written e.g {'inserted': 1, 'updated': 2, 'deleted': 0}
+'''
 
 
 def submit_income_as_payment(interval_id, tax_dict, all_income_submitted=True):
-    # Must delete old payments that were calculated already
-    Payment.objects.filter(interval__id=interval_id).delete()
+    if not all_income_submitted:
+        tax_dict = {}
 
-    if all_income_submitted:
+    with transaction.atomic():
+        # Locking the interval serializes submits of it, as the payments of a first submit have no rows to lock yet
+        list(Interval.objects.select_for_update().filter(pk=interval_id).values_list('id'))
+        existing = {p.user_id: p for p in Payment.objects.filter(interval_id=interval_id)}
+
+        inserts = [Payment(user_id=user_id, interval_id=interval_id, amount=tax_amount)
+                   for user_id, tax_amount in tax_dict.items() if user_id not in existing]
+        updates = []
         for user_id, tax_amount in tax_dict.items():
-            Payment.objects.create(user_id=user_id, interval_id=interval_id, amount=tax_amount)
+            pay = existing.get(user_id)
+            if pay is not None and pay.amount != tax_amount:
+                pay.amount = tax_amount
+                updates.append(pay)
+        deletes = [pay.id for user_id, pay in existing.items() if user_id not in tax_dict]
+
+        Payment.objects.bulk_create(inserts)
+        Payment.objects.bulk_update(updates, ['amount'])
+        if deletes:
+            Payment.objects.filter(id__in=deletes).delete()
+        if inserts or updates:
+            bump_versions('payments')
+
+    counts = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+    logger.info('Submitted payments of interval %s: %s', interval_id, counts)
+    return counts
+
+
+'''
+Recomputes the payments of every interval in one pass over the date-sorted incomes, keeping a sliding window
+of per user sums over the intervals ordered by start date, and writes them in bulk in one transaction.
+Output: Run statistics e.g {'intervals': 40, 'incomes': 1200, 'payments_deleted': 150, 'payments_created': 152}
+'''
+
+
+def recompute_all_payments():
+    intervals = list(Interval.objects.order_by('start_date', 'id'))
+    user_ids = set(User.objects.values_list('id', flat=True))
+    intervals_per_period = get_intervals_per_period()
+
+    window, window_sums, window_counts = deque(), Counter(), Counter()
+    payments = []
+
+    def close_interval(i_o, sums, counts):
+        window.append((sums, counts))
+        window_sums.update(sums)
+        window_counts.update(counts)
+        if len(window) > intervals_per_period:
+            old_sums, old_counts = window.popleft()
+            window_sums.subtract(old_sums)
+            window_counts.subtract(old_counts)
+
+        if not user_ids <= set(counts):
+            return
+        income_dict = {user: div_towards_zero(window_sums[user], intervals_per_period)
+                       for user, count in window_counts.items() if count > 0}
+        for user_id, tax_amount in apply_tax(income_dict, i_o.amount).items():
+            payments.append(Payment(interval_id=i_o.id, user_id=user_id, amount=tax_amount))
+
+    pos, sums, counts, income_count = 0, Counter(), Counter(), 0
+    incs = Income.objects.order_by('date').values_list('date', 'amount', 'incomesource__user')
+    for inc_date, amount, user_id in incs.iterator(chunk_size=2000):
+        income_count += 1
+        while pos < len(intervals) and inc_date > intervals[pos].end_date:
+            close_interval(intervals[pos], sums, counts)
+            pos, sums, counts = pos + 1, Counter(), Counter()
+        if pos < len(intervals) and inc_date >= intervals[pos].start_date:
+            sums[user_id] += amount
+            counts[user_id] += 1
+    for i_o in intervals[pos:]:
+        close_interval(i_o, sums, counts)
+        sums, counts = Counter(), Counter()
+
+    with transaction.atomic():
+        payments_deleted, _ = Payment.objects.all().delete()
+        Payment.objects.bulk_create(payments, batch_size=1000)
+        TaxResult.objects.all().delete()
+        bump_versions('payments')
+
+    return {'intervals': len(intervals), 'incomes': income_count, 'payments_deleted': payments_deleted,
+            'payments_created': len(payments)}
@@ -0,0 +1,54 @@
+from bisect import bisect_right
+from threading import Lock
+
+from django.db import connection
+
+from api.models import Interval
+from api.versions import get_versions
+
+
+class IntervalIndex:
+    """
+    In-memory lookup from a date to the interval containing it, bisecting over the sorted interval boundaries.
+    Intervals are assumed not to overlap. The boundaries are cached with the 'intervals' version they were read at,
+    and each lookup checks that version with one query, so intervals created, moved or deleted by another process
+    are seen. Boundaries read inside a transaction are not cached, as a rollback could leave them pointing at
+    intervals that never existed under a version that is reused.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._cached = None
+
+    def load(self, version=None):
+        if version is None:
+            version, = get_versions(['intervals'])
+        rows = list(Interval.objects.order_by('start_date').values_list('start_date', 'end_date', 'id'))
+        boundaries = ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+        if not connection.in_atomic_block:
+            with self._lock:
+                self._cached = (version, boundaries)
+        return boundaries
+
+    def invalidate(self):
+        with self._lock:
+            self._cached = None
+
+    def lookup(self, inc_date):
+        version, = get_versions(['intervals'])
+        cached = self._cached
+        if cached is not None and cached[0] == version:
+            return self.find(cached[1], inc_date)
+        return self.find(self.load(version), inc_date)
+
+    @staticmethod
+    def find(boundaries, inc_date):
+        starts, ends, ids = boundaries
+        pos = bisect_right(starts, inc_date) - 1
+        if pos >= 0 and inc_date <= ends[pos]:
+            return ids[pos]
+        return None
+
+
+interval_index = IntervalIndex()
+
@@ -0,0 +1,43 @@
+import math
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from api.models import Interval, NumericalParams
+from api.rollup import add_intervals
+
+DAYS_IN_INTERVAL = 14
+
+
+def add_latest_intervals(c_d):
+    """
+    Creates the missing intervals up to the one containing c_d in a single insert.
+    The default interval amount row is locked first, so concurrent callers create each interval only once.
+    """
+    with transaction.atomic():
+        default_interval_amount = NumericalParams.objects.select_for_update().get(pk='default_interval_amount').value
+        l_i = Interval.objects.order_by('-end_date').first()
+        if l_i is None or c_d <= l_i.end_date:
+            return []
+
+        i_to_add = math.ceil((c_d - l_i.end_date).days / DAYS_IN_INTERVAL)
+        new_intervals = []
+        for i in range(i_to_add):
+            n_sd = l_i.end_date + timedelta(days=1 + i * DAYS_IN_INTERVAL)
+            n_ed = n_sd + timedelta(days=DAYS_IN_INTERVAL - 1)
+            new_intervals.append(Interval(start_date=n_sd, end_date=n_ed, amount=default_interval_amount))
+        Interval.objects.bulk_create(new_intervals)
+
+        # Not every backend returns the ids of bulk inserted rows
+        new_intervals = list(Interval.objects.filter(start_date__gt=l_i.end_date).order_by('start_date'))
+        add_intervals(new_intervals)
+    return new_intervals
+
+
+def roll_intervals(ahead_days=0):
+    """ Makes sure an interval contains the date ahead_days from today, costing a single query when one does """
+    c_d = date.today() + timedelta(days=ahead_days)
+    l_ed = Interval.objects.order_by('-end_date').values_list('end_date', flat=True).first()
+    if l_ed is not None and c_d <= l_ed:
+        return []
+    return add_latest_intervals(c_d)
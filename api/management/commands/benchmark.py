@@ -0,0 +1,161 @@
+import json
+import statistics
+import time
+from datetime import date, datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+
+from api import urls
+from api.middleware import QueryCounter
+from api.models import User, IncomeSource, Interval, Income, Payment
+
+API_PREFIX = '/api/'
+BATCH_SIZE = 100
+
+
+def get_sample(today=None):
+    """ Picks the ids the parametrised routes are requested with, preferring the latest finished interval """
+    today = today or date.today()
+    live_i = Interval.objects.order_by('-end_date').first()
+    user = User.objects.order_by('id').first()
+    if live_i is None or user is None:
+        raise CommandError('There is no data to benchmark, run generate_data first.')
+    i_o = Interval.objects.filter(end_date__lt=today).order_by('-end_date').first() or live_i
+    income = Income.objects.filter(interval=i_o).order_by('-id').first() or Income.objects.order_by('-id').first()
+    source = IncomeSource.objects.filter(user=user).order_by('id').first()
+    return {'interval': i_o, 'live_interval': live_i, 'user': user, 'income': income, 'income_source': source}
+
+
+'''
+The requests made for every route of api.urls, as (route, method, path, body, needs an admin) tuples.
+Routes missing here are reported, so new routes are not silently left out of the benchmark.
+'''
+
+
+def get_requests(sample):
+    i_id, live_id, user_id = sample['interval'].id, sample['live_interval'].id, sample['user'].id
+    income = {'incomesource': sample['income_source'].id if sample['income_source'] else None, 'amount': 100,
+              'date': sample['live_interval'].start_date.isoformat()}
+    income_id = sample['income'].id if sample['income'] else 0
+    return [
+        ('', 'GET', '', None, False),
+        ('interval/<str:interval>/amount/', 'PATCH', 'interval/%d/amount/' % i_id, {'amount': 1200}, False),
+        ('income/', 'POST', 'income/', income, False),
+        ('income/batch/', 'POST', 'income/batch/', [income] * BATCH_SIZE, False),
+        ('payment/', 'POST', 'payment/', {'interval': live_id, 'user': user_id, 'amount': 100}, False),
+        ('tax/simulate/', 'POST', 'tax/simulate/', {'amounts': [None, 1000, 2000], 'degrees': [1, 2]}, True),
+        ('tax/recompute/', 'POST', 'tax/recompute/', None, True),
+        ('intervals/', 'GET', 'intervals/', None, False),
+        ('users/', 'GET', 'users/', None, False),
+        ('income-sources/<str:user>/', 'GET', 'income-sources/%s/' % user_id, None, False),
+        ('payment/<str:interval>/', 'GET', 'payment/%d/' % i_id, None, False),
+        ('tax/<str:interval>/', 'GET', 'tax/%d/' % i_id, None, False),
+        ('income/income-source/<str:interval>/', 'GET', 'income/income-source/%d/' % i_id, None, False),
+        ('income/averaged/<str:interval>', 'GET', 'income/averaged/%d' % i_id, None, False),
+        ('users/unsubmitted/<str:interval>', 'GET', 'users/unsubmitted/%d' % live_id, None, False),
+        ('interval/<str:interval>/dashboard', 'GET', 'interval/%d/dashboard' % i_id, None, False),
+        ('metrics/total-income', 'GET', 'metrics/total-income', None, False),
+        ('metrics/total-paid', 'GET', 'metrics/total-paid', None, False),
+        ('metrics/total-income-by-interval', 'GET', 'metrics/total-income-by-interval', None, False),
+        ('metrics/total-payment-by-interval', 'GET', 'metrics/total-payment-by-interval', None, False),
+        ('metrics/server', 'GET', 'metrics/server', None, True),
+        ('export/incomes', 'GET', 'export/incomes', None, False),
+        ('export/payments', 'GET', 'export/payments', None, False),
+        ('income/<str:income>', 'DELETE', 'income/%d' % income_id, None, False),
+        ('numerical-params/', 'GET', 'numerical-params/', None, False),
+        ('numerical-params/', 'PATCH', 'numerical-params/', {'key': 'intervals_per_period', 'value': 2}, False),
+    ]
+
+
+def get_client():
+    # Outside of the test runner the test client's host has to be one of the allowed ones
+    hosts = [h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')]
+    return Client(SERVER_NAME=hosts[0] if hosts else 'localhost')
+
+
+def run_request(client, method, path, body):
+    """ Makes a request and reads the whole response, returning (status code, size in bytes, QueryCounter) """
+    data = '' if body is None else json.dumps(body)
+    timer = QueryCounter()
+    with connection.execute_wrapper(timer):
+        response = client.generic(method, API_PREFIX + path, data, content_type='application/json')
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+    return response.status_code, len(content), timer
+
+
+def time_route(method, path, body, admin, repeat):
+    """
+    Times a route repeat times. Every request runs in a transaction that is rolled back afterwards, GETs included
+    as some of them store computed results, so every repetition sees the same data and the benchmark leaves the
+    database unchanged.
+    """
+    runs = []
+    for _ in range(repeat):
+        with transaction.atomic():
+            client = get_client()
+            if admin:
+                client.force_login(get_user_model().objects.create_superuser('benchmark-admin'))
+            start = time.perf_counter()
+            status_code, size, timer = run_request(client, method, path, body)
+            runs.append((time.perf_counter() - start, status_code, size, timer))
+            transaction.set_rollback(True)
+
+    times = [r[0] * 1000 for r in runs]
+    return {
+        'status': runs[-1][1],
+        'bytes': runs[-1][2],
+        'first_ms': round(times[0], 3),
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'max_ms': round(max(times), 3),
+        'queries': [r[3].count for r in runs],
+        'sql_ms': round(statistics.median(r[3].seconds * 1000 for r in runs), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Times every API route against the current database, recording wall time, SQL queries and response '
+            'sizes to a JSON file. Writes made by the routes are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Requests made per route.')
+        parser.add_argument('--route', action='append', default=[],
+                            help='Only benchmark routes containing this text. Can be repeated.')
+        parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+
+        requests = get_requests(get_sample())
+        api_routes = [str(p.pattern) for p in urls.urlpatterns]
+        missing = [route for route in api_routes if route not in {r[0] for r in requests}]
+        for route in missing:
+            self.stderr.write('No benchmark request for the route %r' % route)
+
+        results = []
+        for route, method, path, body, admin in requests:
+            if options['route'] and not any(text in route for text in options['route']):
+                continue
+            result = {'route': route, 'method': method, 'path': API_PREFIX + path,
+                      **time_route(method, path, body, admin, options['repeat'])}
+            results.append(result)
+            self.stdout.write('%-6s %-40s %4d %10.2fms %5d queries' % (
+                method, route or '/', result['status'], result['median_ms'], result['queries'][-1]))
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'database': {'vendor': connection.vendor, 'name': str(connection.settings_dict['NAME'])},
+            'dataset': {model.__name__.lower(): model.objects.count()
+                        for model in [User, IncomeSource, Interval, Income, Payment]},
+            'repeat': options['repeat'],
+            'missing_routes': missing,
+            'routes': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS('Wrote %d route timings to %s.' % (len(results), options['output'])))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.intervals import roll_intervals
+
+
+class Command(BaseCommand):
+    help = 'Creates the intervals up to the one containing today plus the look ahead. Safe to run every minute.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead-days', type=int, default=settings.INTERVAL_ROLLOVER_AHEAD_DAYS,
+                            help='Also create the intervals containing the next this many days.')
+
+    def handle(self, *args, **options):
+        created = roll_intervals(options['ahead_days'])
+        if created:
+            self.stdout.write(self.style.SUCCESS('Created %d intervals up to %s.' % (len(created), created[-1].end_date)))
+        else:
+            self.stdout.write('Intervals are up to date.')
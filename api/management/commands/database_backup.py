@@ -0,0 +1,123 @@
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from api.datagen import clear_data
+from api.models import User, IncomeSource, Interval, NumericalParams, Income, Payment, TaxResult
+from api.rollup import assign_income_intervals, rebuild_income_rollup
+from api.versions import bump_versions
+
+# Backup files in foreign key order, with their columns in file order
+TABLES = [
+    ('user', User, ['id', 'name']),
+    ('incomesource', IncomeSource, ['id', 'name', 'user_id']),
+    ('interval', Interval, ['id', 'start_date', 'end_date', 'amount']),
+    ('numericalparams', NumericalParams, ['key', 'value']),
+    ('income', Income, ['id', 'amount', 'date', 'incomesource_id']),
+    ('payment', Payment, ['id', 'amount', 'interval_id', 'user_id']),
+]
+BATCH_SIZE = 1000
+
+
+def read_table(path):
+    """ Streams the rows of a pipe delimited ASCII table as dicts keyed by the header cells """
+    header = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('|-'):
+                continue
+            cells = [cell.strip() for cell in line.strip('|').split('|')]
+            if header is None:
+                header = cells
+            else:
+                yield dict(zip(header, cells))
+
+
+def format_row(values, widths):
+    cells = [str(v).rjust(w) if isinstance(v, int) else str(v).ljust(w) for v, w in zip(values, widths)]
+    return '| ' + ' | '.join(cells) + ' |'
+
+
+def write_table(path, model, columns):
+    """ Writes a table in two streaming passes, the first one measuring the column widths """
+    rows = model.objects.order_by('pk').values_list(*columns)
+    widths = [len(c) for c in columns]
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        widths = [max(w, len(str(v))) for w, v in zip(widths, row)]
+
+    separator = '|' + '|'.join('-' * (w + 2) for w in widths) + '|'
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\r\n') as f:
+        f.write(separator + '\n' + format_row(columns, widths) + '\n')
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            f.write(separator + '\n' + format_row(row, widths) + '\n')
+            count += 1
+        f.write(separator + '\n')
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Loads the database-backup ASCII table dumps into the database, or dumps the database into them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['load', 'dump'])
+        parser.add_argument('--dir', default='database-backup', help='Directory of the <table>.txt files.')
+        parser.add_argument('--replace', action='store_true', help='Delete the existing rows before loading.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['action'] == 'load':
+            counts = self.load(options['dir'], options['replace'])
+        else:
+            counts = self.dump(options['dir'])
+        summary = ', '.join('%d %s' % (count, name) for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS('%s %s in %.2fs.' % (
+            'Loaded' if options['action'] == 'load' else 'Dumped', summary, time.perf_counter() - start)))
+
+    def load(self, directory, replace):
+        data_models = [model for _, model, _ in TABLES if model is not NumericalParams]
+        with transaction.atomic():
+            if replace:
+                # Derived tables are rebuilt below, so rows are deleted without per row signals
+                clear_data()
+            elif any(model.objects.exists() for model in data_models):
+                raise CommandError('The database already has data, use --replace to overwrite it.')
+
+            counts = {}
+            for name, model, columns in TABLES:
+                fields = [model._meta.get_field(c) for c in columns]
+                rows = (model(**{f.attname: f.to_python(row[c]) for f, c in zip(fields, columns)})
+                        for row in read_table(os.path.join(directory, name + '.txt')))
+                if model is NumericalParams:
+                    params = list(rows)
+                    NumericalParams.objects.filter(key__in=[p.key for p in params]).delete()
+                    rows = iter(params)
+
+                counts[name] = 0
+                while True:
+                    batch = list(islice(rows, BATCH_SIZE))
+                    if not batch:
+                        break
+                    model.objects.bulk_create(batch)
+                    counts[name] += len(batch)
+
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), data_models):
+                    cursor.execute(sql)
+
+            # Bulk inserts skip the signals maintaining the derived tables
+            assign_income_intervals()
+            rebuild_income_rollup()
+            TaxResult.objects.all().delete()
+            bump_versions('users', 'numerical_params', 'intervals', 'payments')
+        return counts
+
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        return {name: write_table(os.path.join(directory, name + '.txt'), model, columns)
+                for name, model, columns in TABLES}
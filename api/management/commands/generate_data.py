@@ -0,0 +1,41 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.datagen import clear_data, generate_dataset
+from api.models import User, Interval, Income
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a reproducible synthetic dataset of users, income sources, intervals and incomes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--sources-per-user', type=int, default=3)
+        parser.add_argument('--intervals', type=int, default=52)
+        parser.add_argument('--incomes-per-interval', type=int, default=4, help='Incomes per user and interval.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--end-date', type=date.fromisoformat,
+                            help='Date contained by the last interval, today by default.')
+        parser.add_argument('--no-payments', action='store_true', help='Do not compute the tax payments.')
+        parser.add_argument('--replace', action='store_true', help='Delete the existing data first.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            if options['replace']:
+                clear_data()
+            elif any(model.objects.exists() for model in [User, Interval, Income]):
+                raise CommandError('The database already has data, use --replace to overwrite it.')
+            try:
+                counts = generate_dataset(
+                    options['users'], options['sources_per_user'], options['intervals'],
+                    options['incomes_per_interval'], seed=options['seed'], end_date=options['end_date'],
+                    payments=not options['no_payments'])
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+
+        summary = ', '.join('%d %s' % (count, name.replace('_', ' ')) for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS('Generated %s in %.2fs.' % (summary, time.perf_counter() - start)))
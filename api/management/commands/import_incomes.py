@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import time
+from contextlib import nullcontext
+from datetime import date
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.interval_index import IntervalIndex, interval_index
+from api.models import Income, IncomeSource, User
+from api.rollup import apply_income_rows
+
+
+def read_rows(path, file_format):
+    """ Streams (line number, row dict) pairs from a CSV file with a header row or from an NDJSON file """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        raise CommandError('%s line %d: invalid JSON (%s)' % (path, line_no, e)) from e
+                    yield line_no, row
+
+
+class Command(BaseCommand):
+    help = ('Imports incomes from CSV or NDJSON files with user, income_source, amount and date columns. '
+            'Missing income sources are created. Each chunk of rows is committed on its own, so an import stopped '
+            'by an invalid row keeps the chunks before it, unless --atomic is given.')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_ids = set()
+        self.sources = {}
+        self.boundaries = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='CSV (.csv) or NDJSON (.ndjson, .jsonl) files to import.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='File format, inferred from the file extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows inserted per statement.')
+        parser.add_argument('--atomic', action='store_true',
+                            help='Import every file in one transaction, importing nothing if a row is invalid.')
+
+    def handle(self, *args, **options):
+        self.user_ids = set(User.objects.values_list('id', flat=True))
+        self.sources = {(s.user_id, s.name): s.id for s in IncomeSource.objects.all()}
+        self.boundaries = interval_index.load()
+
+        start = time.perf_counter()
+        with transaction.atomic() if options['atomic'] else nullcontext():
+            total = self.import_files(options)
+
+        seconds = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS('Imported %d incomes in %.2fs (%d rows/s).' % (
+            total, seconds, total / seconds if seconds else 0)))
+
+    def import_files(self, options):
+        total = 0
+        for path in options['files']:
+            file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+            rows = (self.parse_row(path, line_no, row) for line_no, row in read_rows(path, file_format))
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                self.insert_chunk(chunk)
+                total += len(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write('Imported %d rows' % total)
+        return total
+
+    def parse_row(self, path, line_no, row):
+        try:
+            user_id, source_name = row['user'], row['income_source']
+            amount, inc_date = int(row['amount']), date.fromisoformat(row['date'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise CommandError('%s line %d: invalid row %r (%s)' % (path, line_no, row, e)) from e
+        if user_id not in self.user_ids:
+            raise CommandError('%s line %d: unknown user %r' % (path, line_no, user_id))
+        return user_id, self.get_income_source_id(user_id, source_name), amount, inc_date
+
+    def get_income_source_id(self, user_id, name):
+        key = (user_id, name)
+        if key not in self.sources:
+            self.sources[key] = IncomeSource.objects.get_or_create(user_id=user_id, name=name)[0].id
+        return self.sources[key]
+
+    def insert_chunk(self, chunk):
+        rows = [(user_id, source_id, amount, inc_date, IntervalIndex.find(self.boundaries, inc_date))
+                for user_id, source_id, amount, inc_date in chunk]
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                self.copy_rows(rows)
+            else:
+                Income.objects.bulk_create([
+                    Income(incomesource_id=source_id, amount=amount, date=inc_date, interval_id=interval_id)
+                    for _, source_id, amount, inc_date, interval_id in rows])
+            apply_income_rows([(interval_id, user_id, source_id, amount)
+                               for user_id, source_id, amount, _, interval_id in rows if interval_id is not None])
+
+    def copy_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            (source_id, amount, inc_date.isoformat(), '' if interval_id is None else interval_id)
+            for _, source_id, amount, inc_date, interval_id in rows)
+        buffer.seek(0)
+
+        columns = ', '.join(Income._meta.get_field(name).column for name in ['incomesource', 'amount', 'date', 'interval'])
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (Income._meta.db_table, columns),
+                                      buffer)
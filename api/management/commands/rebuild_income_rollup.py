@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.rollup import assign_income_intervals, rebuild_income_rollup
+
+
+class Command(BaseCommand):
+    help = 'Reassigns every income to its interval and rebuilds the income rollup from the raw incomes.'
+
+    def handle(self, *args, **options):
+        income_count = assign_income_intervals()
+        rollup_count = rebuild_income_rollup()
+        self.stdout.write(self.style.SUCCESS(
+            'Moved %d incomes to a new interval and rebuilt %d income rollup rows.' % (income_count, rollup_count)))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.helpers import recompute_all_payments
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the tax payments of every interval in one pass over the income history.'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stats = recompute_all_payments()
+        self.stdout.write(self.style.SUCCESS(
+            'Recomputed %(intervals)d intervals from %(incomes)d incomes: deleted %(payments_deleted)d and created '
+            '%(payments_created)d payments' % stats + ' in %.2fs.' % (time.perf_counter() - start)))
@@ -0,0 +1,20 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.scheduler import run_interval_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Keeps creating the intervals up to the one containing today plus the look ahead, until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', type=int, default=settings.INTERVAL_SCHEDULER_PERIOD,
+                            help='Seconds between rollovers.')
+        parser.add_argument('--ahead-days', type=int, default=settings.INTERVAL_ROLLOVER_AHEAD_DAYS,
+                            help='Also create the intervals containing the next this many days.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rolling intervals over every %ds.' % options['period'])
+        run_interval_scheduler(options['period'], options['ahead_days'], threading.Event())
@@ -0,0 +1,246 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from threading import Lock
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Upper bounds in seconds of the latency histogram buckets, the Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+UNMATCHED_ROUTE = '<unmatched>'
+# Methods recorded under their own label, any other one is recorded as OTHER
+HTTP_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'])
+
+
+class QueryCounter:
+    """ Database execute wrapper counting the queries made and the seconds spent in them, from any thread """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.count += 1
+                self.seconds += seconds
+
+
+def prometheus_labels(route, method):
+    return 'route="%s",method="%s"' % (route.replace('\\', '\\\\').replace('"', '\\"'), method)
+
+
+class RouteStats:
+    __slots__ = ['count', 'buckets', 'seconds', 'max_seconds', 'statuses', 'queries', 'sql_seconds',
+                 'sized', 'response_bytes']
+
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # The last one counts requests over every bound
+        self.seconds = 0
+        self.max_seconds = 0
+        self.statuses = {}
+        self.queries = 0
+        self.sql_seconds = 0
+        self.sized = 0
+        self.response_bytes = 0
+
+    def copy(self):
+        stats = RouteStats()
+        for name in self.__slots__:
+            setattr(stats, name, getattr(self, name))
+        stats.buckets, stats.statuses = list(self.buckets), dict(self.statuses)
+        return stats
+
+    def quantile(self, q):
+        """ Estimates a latency quantile as the upper bound of the bucket it falls in """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+
+class RequestMetrics:
+    """
+    Per route and method request statistics, aggregated in process. Each worker process keeps its own,
+    so a deployment with several workers reports the ones of the worker answering the metrics request.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+            self.started_at = datetime.now(timezone.utc)
+
+    def record(self, route, method, status_code, seconds, queries, sql_seconds, response_bytes=None):
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = RouteStats()
+            stats.count += 1
+            stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            status_class = '%dxx' % (status_code // 100)
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            if response_bytes is not None:
+                stats.sized += 1
+                stats.response_bytes += response_bytes
+
+    def _copy(self):
+        with self._lock:
+            return sorted((key, stats.copy()) for key, stats in self._routes.items())
+
+    '''
+    Output: e.g {'started_at': '2022-01-01T00:00:00+00:00', 'routes': [{'route': 'api/users/', 'method': 'GET',
+        'count': 2, 'statuses': {'2xx': 2}, 'latency_ms': {'mean': 3.1, 'max': 4.0, 'p50': 4.0, 'p95': 4.0,
+        'p99': 4.0, 'buckets': {'5': 2, ...}}, 'sql': {'queries': 2, 'per_request': 1.0, 'ms': 0.4},
+        'response_bytes': {'total': 120, 'mean': 60.0}}]}
+    '''
+
+    def snapshot(self):
+        routes = []
+        for (route, method), stats in self._copy():
+            routes.append({
+                'route': route,
+                'method': method,
+                'count': stats.count,
+                'statuses': dict(stats.statuses),
+                'latency_ms': {
+                    'mean': round(stats.seconds / stats.count * 1000, 3),
+                    'max': round(stats.max_seconds * 1000, 3),
+                    'p50': round(stats.quantile(0.5) * 1000, 3),
+                    'p95': round(stats.quantile(0.95) * 1000, 3),
+                    'p99': round(stats.quantile(0.99) * 1000, 3),
+                    'buckets': {**{'%g' % (bound * 1000): count
+                                   for bound, count in zip(LATENCY_BUCKETS, stats.buckets)}, '+Inf': stats.buckets[-1]},
+                },
+                'sql': {'queries': stats.queries, 'per_request': round(stats.queries / stats.count, 3),
+                        'ms': round(stats.sql_seconds * 1000, 3)},
+                'response_bytes': {'total': stats.response_bytes,
+                                   'mean': round(stats.response_bytes / stats.sized, 1) if stats.sized else None},
+            })
+        return {'started_at': self.started_at.isoformat(), 'routes': routes}
+
+    def prometheus(self):
+        """ Renders the statistics in the Prometheus text exposition format """
+        lines = [
+            '# HELP api_request_duration_seconds Request latency by route.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        routes = self._copy()
+        for (route, method), stats in routes:
+            labels = prometheus_labels(route, method)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append('api_request_duration_seconds_bucket{%s,le="%g"} %d' % (labels, bound, cumulative))
+            lines.append('api_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, stats.count))
+            lines.append('api_request_duration_seconds_sum{%s} %f' % (labels, stats.seconds))
+            lines.append('api_request_duration_seconds_count{%s} %d' % (labels, stats.count))
+
+        counters = [
+            ('api_responses_total', 'Responses by route and status class.',
+             lambda stats: [('status="%s"' % status_class, count)
+                            for status_class, count in sorted(stats.statuses.items())]),
+            ('api_sql_queries_total', 'SQL queries made by route.', lambda stats: [('', stats.queries)]),
+            ('api_sql_duration_seconds_total', 'Seconds spent in SQL queries by route.',
+             lambda stats: [('', stats.sql_seconds)]),
+            ('api_response_bytes_total', 'Response body bytes by route, streamed responses excluded.',
+             lambda stats: [('', stats.response_bytes)]),
+        ]
+        for name, help_text, values in counters:
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+            for (route, method), stats in routes:
+                labels = prometheus_labels(route, method)
+                for extra, value in values(stats):
+                    lines.append('%s{%s} %s' % (name, labels + (',' + extra if extra else ''), value))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+# Counter of the request being handled. Worker threads running ORM calls for async views inherit it.
+current_query_counter = ContextVar('current_query_counter', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = current_query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    """ Adds count_query to a connection's execute wrappers, which outlive its reconnections """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+connection_created.connect(install_query_counter)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, SQL queries and response size of every request in request_metrics.
+    Streamed responses are timed until their first byte, and their size is not recorded.
+    Works both under WSGI and ASGI, where it does not push async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # pylint: disable=protected-access
+        # Connections opened before this middleware was loaded missed connection_created
+        for alias in connections:
+            install_query_counter(connections[alias])
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = current_query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = current_query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_counter.reset(token)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    @staticmethod
+    def record(request, response, seconds, counter):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else UNMATCHED_ROUTE
+        method = request.method if request.method in HTTP_METHODS else 'OTHER'
+        request_metrics.record(route, method, response.status_code, seconds, counter.count, counter.seconds,
+                               None if response.streaming else len(response.content))
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.7 on 2026-10-16 22:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+
+
+def build_income_rollup(apps, schema_editor):
+    Income = apps.get_model('api', 'Income')
+    IncomeRollup = apps.get_model('api', 'IncomeRollup')
+    Interval = apps.get_model('api', 'Interval')
+
+    rollups = []
+    for i_o in Interval.objects.all():
+        incs = Income.objects.filter(date__gte=i_o.start_date, date__lte=i_o.end_date).values(
+            'incomesource', 'incomesource__user').annotate(amount_sum=Sum('amount'), income_count=Count('id'))
+        rollups += [
+            IncomeRollup(interval_id=i_o.id, user_id=inc['incomesource__user'], incomesource_id=inc['incomesource'],
+                         amount_sum=inc['amount_sum'], income_count=inc['income_count'])
+            for inc in incs
+        ]
+    IncomeRollup.objects.bulk_create(rollups)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_payment_unique_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncomeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_sum', models.IntegerField(default=0)),
+                ('income_count', models.IntegerField(default=0)),
+                ('incomesource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.incomesource')),
+                ('interval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.interval')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.user')),
+            ],
+            options={
+                'unique_together': {('interval', 'user', 'incomesource')},
+            },
+        ),
+        migrations.RunPython(build_income_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.7 on 2026-10-16 22:27
+
+from bisect import bisect_right
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_income_interval(apps, schema_editor):
+    Income = apps.get_model('api', 'Income')
+    Interval = apps.get_model('api', 'Interval')
+
+    rows = list(Interval.objects.order_by('start_date').values_list('start_date', 'end_date', 'id'))
+    starts = [r[0] for r in rows]
+    incs = []
+    for inc in Income.objects.only('id', 'date'):
+        pos = bisect_right(starts, inc.date) - 1
+        if pos >= 0 and inc.date <= rows[pos][1]:
+            inc.interval_id = rows[pos][2]
+            incs.append(inc)
+    Income.objects.bulk_update(incs, ['interval'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_incomerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='income',
+            name='interval',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.interval'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['interval', 'incomesource'], name='api_income_interva_bea95f_idx'),
+        ),
+        migrations.RunPython(backfill_income_interval, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.7 on 2026-10-16 22:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_income_interval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaxResult',
+            fields=[
+                ('interval', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='api.interval')),
+                ('version', models.CharField(max_length=40)),
+                ('all_income_submitted', models.BooleanField()),
+                ('tax', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.7 on 2026-10-16 22:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def build_income_prefix(apps, schema_editor):
+    IncomePrefix = apps.get_model('api', 'IncomePrefix')
+    IncomeRollup = apps.get_model('api', 'IncomeRollup')
+    Interval = apps.get_model('api', 'Interval')
+    NumericalParams = apps.get_model('api', 'NumericalParams')
+    User = apps.get_model('api', 'User')
+
+    NumericalParams.objects.get_or_create(key='intervals_per_period', defaults={'value': 2})
+
+    sums = {(r['interval'], r['user']): (r['amount'], r['count']) for r in IncomeRollup.objects.values(
+        'interval', 'user').annotate(amount=Sum('amount_sum'), count=Sum('income_count')).order_by()}
+    user_ids = list(User.objects.values_list('id', flat=True))
+    running = {user_id: [0, 0] for user_id in user_ids}
+    prefixes = []
+    for interval_id in Interval.objects.order_by('start_date', 'id').values_list('id', flat=True):
+        for user_id in user_ids:
+            amount, count = sums.get((interval_id, user_id), (0, 0))
+            running[user_id][0] += amount
+            running[user_id][1] += count
+            prefixes.append(IncomePrefix(interval_id=interval_id, user_id=user_id, amount_total=running[user_id][0],
+                                         income_count=running[user_id][1]))
+    IncomePrefix.objects.bulk_create(prefixes, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_taxresult_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncomePrefix',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_total', models.BigIntegerField(default=0)),
+                ('income_count', models.BigIntegerField(default=0)),
+                ('interval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.interval')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.user')),
+            ],
+            options={
+                'unique_together': {('user', 'interval')},
+            },
+        ),
+        migrations.RunPython(build_income_prefix, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_incomeprefix'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='interval',
+            index=models.Index(fields=['end_date', 'id'], name='api_interva_end_dat_847c93_idx'),
+        ),
+    ]
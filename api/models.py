@@ -21,11 +21,29 @@ class Interval(models.Model):
     end_date = models.DateField()
     amount = models.IntegerField(default=1100)
 
+    class Meta:
+        # Backs the latest first interval list and its keyset pagination
+        indexes = [models.Index(fields=['end_date', 'id'])]
+
 
 class Income(models.Model):
     incomesource = models.ForeignKey(IncomeSource, on_delete=models.CASCADE)
     amount = models.IntegerField()
     date = models.DateField()
+    # Interval containing the date, kept in sync on save. Indexed through the composite index below.
+    interval = models.ForeignKey(Interval, on_delete=models.SET_NULL, null=True, editable=False, db_index=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['interval', 'incomesource'])]
+
+
+class PaymentQuerySet(models.QuerySet):
+    def delete(self):
+        from api.versions import bump_versions  # pylint: disable=import-outside-toplevel
+        deleted = super().delete()
+        if deleted[0]:
+            bump_versions('payments')
+        return deleted
 
 
 class Payment(models.Model):
@@ -33,10 +51,54 @@ class Payment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.IntegerField()
 
+    # Payments have no post_delete receiver, so a queryset of them is deleted in a single query without fetching it.
+    # Deletes bump the 'payments' version here instead, and cascades from intervals and users in their receivers.
+    objects = PaymentQuerySet.as_manager()
+
     class Meta:
         unique_together = ('interval', 'user')
 
+    def delete(self, using=None, keep_parents=False):
+        from api.versions import bump_versions  # pylint: disable=import-outside-toplevel
+        deleted = super().delete(using, keep_parents)
+        bump_versions('payments')
+        return deleted
+
 
 class NumericalParams(models.Model):
     key = models.CharField(max_length=100, primary_key=True)
     value = models.IntegerField()
+
+
+class IncomeRollup(models.Model):
+    interval = models.ForeignKey(Interval, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    incomesource = models.ForeignKey(IncomeSource, on_delete=models.CASCADE)
+    amount_sum = models.IntegerField(default=0)
+    income_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('interval', 'user', 'incomesource')
+
+
+class IncomePrefix(models.Model):
+    # Running totals of the user's incomes over the intervals ordered by start date, up to and including interval.
+    interval = models.ForeignKey(Interval, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    amount_total = models.BigIntegerField(default=0)
+    income_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'interval')
+
+
+class DataVersion(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+
+class TaxResult(models.Model):
+    interval = models.OneToOneField(Interval, on_delete=models.CASCADE, primary_key=True)
+    version = models.CharField(max_length=40)
+    all_income_submitted = models.BooleanField()
+    tax = models.JSONField(default=dict)
@@ -0,0 +1,194 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from api.interval_index import IntervalIndex, interval_index
+from api.models import Income, IncomePrefix, IncomeRollup, Interval, User
+from api.versions import bump_versions, income_version_key
+
+'''
+Maintains IncomeRollup, the per interval, user and income source sums of Income, and IncomePrefix, the running
+per user sums of the rollup over the intervals ordered by start date.
+An income is counted in the interval referenced by its interval foreign key. The prefix rows of a user always
+cover a suffix of the ordered intervals; intervals before the user's first row have a running total of 0.
+'''
+
+
+def get_income_rows(incomes):
+    """ Expands incomes into (interval_id, user_id, incomesource_id, amount) rows """
+    return [(inc.interval_id, inc.incomesource.user_id, inc.incomesource_id, inc.amount)
+            for inc in incomes if inc.interval_id is not None]
+
+
+def apply_income_rows(rows, sign=1):
+    deltas = defaultdict(lambda: [0, 0])
+    user_deltas = defaultdict(lambda: [0, 0])
+    for interval_id, user_id, incomesource_id, amount in rows:
+        for delta in (deltas[(interval_id, user_id, incomesource_id)], user_deltas[(interval_id, user_id)]):
+            delta[0] += sign * amount
+            delta[1] += sign
+
+    with transaction.atomic():
+        bump_versions('incomes', *[income_version_key(interval_id) for interval_id, _, _ in deltas])
+        for (interval_id, user_id, incomesource_id), (amount, count) in deltas.items():
+            key = {'interval_id': interval_id, 'user_id': user_id, 'incomesource_id': incomesource_id}
+            updated = IncomeRollup.objects.filter(**key).update(
+                amount_sum=F('amount_sum') + amount, income_count=F('income_count') + count)
+            if count <= 0:
+                IncomeRollup.objects.filter(income_count__lte=0, **key).delete()
+                continue
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    IncomeRollup.objects.create(amount_sum=amount, income_count=count, **key)
+            except IntegrityError:  # Created by a concurrent request in the meantime.
+                IncomeRollup.objects.filter(**key).update(
+                    amount_sum=F('amount_sum') + amount, income_count=F('income_count') + count)
+
+        apply_prefix_deltas(user_deltas)
+
+
+def apply_prefix_deltas(user_deltas):
+    """ Adds (interval_id, user_id) deltas to the running totals of that interval and every later one """
+    interval_starts = dict(Interval.objects.filter(id__in={k[0] for k in user_deltas}).values_list('id', 'start_date'))
+    rebuild_user_ids = set()
+    for (interval_id, user_id), (amount, count) in user_deltas.items():
+        if user_id in rebuild_user_ids:
+            continue
+        if not IncomePrefix.objects.filter(interval_id=interval_id, user_id=user_id).exists():
+            # Removals can only miss the running totals when a user delete cascaded to them first
+            if count > 0:
+                rebuild_user_ids.add(user_id)
+            continue
+        IncomePrefix.objects.filter(user_id=user_id, interval__start_date__gte=interval_starts[interval_id]).update(
+            amount_total=F('amount_total') + amount, income_count=F('income_count') + count)
+    if rebuild_user_ids:
+        rebuild_income_prefix(user_ids=rebuild_user_ids)
+
+
+def add_incomes(incomes):
+    """ Inserts unsaved incomes in bulk and rolls them up once for the whole batch """
+    boundaries = interval_index.load()
+    for inc in incomes:
+        inc.interval_id = IntervalIndex.find(boundaries, inc.date)
+
+    with transaction.atomic():
+        Income.objects.bulk_create(incomes, batch_size=1000)
+        apply_income_rows(get_income_rows(incomes))
+    return incomes
+
+
+def assign_income_intervals(incomes=None):
+    """ Points incomes at the interval containing their date, returning how many changed """
+    if incomes is None:
+        incomes = Income.objects.only('id', 'date', 'interval')
+    boundaries = interval_index.load()
+
+    changed = []
+    for inc in incomes:
+        interval_id = IntervalIndex.find(boundaries, inc.date)
+        if inc.interval_id != interval_id:
+            inc.interval_id = interval_id
+            changed.append(inc)
+    Income.objects.bulk_update(changed, ['interval'], batch_size=1000)
+    return len(changed)
+
+
+def rebuild_income_rollup(interval_ids=None, from_date=None):
+    """
+    Recomputes the rollup of the given intervals, or of every interval when none are given, and the running totals
+    from the earliest of their start dates and from_date
+    """
+    if interval_ids is not None and not interval_ids:
+        return IncomeRollup.objects.count()
+
+    with transaction.atomic():
+        rollups = IncomeRollup.objects.all()
+        incs = Income.objects.filter(interval__isnull=False)
+        if interval_ids is not None:
+            rollups = rollups.filter(interval__in=interval_ids)
+            incs = incs.filter(interval__in=interval_ids)
+            bump_versions('incomes', *[income_version_key(interval_id) for interval_id in interval_ids])
+        else:
+            bump_versions('incomes', 'income:all')
+        rollups.delete()
+
+        incs = incs.values('interval', 'incomesource', 'incomesource__user').annotate(
+            amount_sum=Sum('amount'), income_count=Count('id')).order_by()
+        IncomeRollup.objects.bulk_create([
+            IncomeRollup(interval_id=inc['interval'], user_id=inc['incomesource__user'],
+                         incomesource_id=inc['incomesource'], amount_sum=inc['amount_sum'],
+                         income_count=inc['income_count'])
+            for inc in incs
+        ], batch_size=1000)
+
+        if interval_ids is None:
+            from_date = None
+        else:
+            from_date = min([*Interval.objects.filter(id__in=interval_ids).values_list('start_date', flat=True),
+                             *([from_date] if from_date else [])], default=None)
+        rebuild_income_prefix(from_date)
+    return IncomeRollup.objects.count()
+
+
+def rebuild_income_prefix(from_date=None, user_ids=None):
+    """ Recomputes the running totals of the intervals starting from from_date, for the given or all users """
+    with transaction.atomic():
+        intervals = Interval.objects.order_by('start_date', 'id')
+        prefixes = IncomePrefix.objects.all()
+        rollups = IncomeRollup.objects.all()
+        if user_ids is None:
+            user_ids = User.objects.values_list('id', flat=True)
+        else:
+            prefixes = prefixes.filter(user__in=user_ids)
+            rollups = rollups.filter(user__in=user_ids)
+
+        running = {user_id: [0, 0] for user_id in user_ids}
+        if from_date is not None:
+            prev_i = intervals.filter(start_date__lt=from_date).last()
+            if prev_i is not None:
+                for user_id, amount_total, income_count in prefixes.filter(interval=prev_i).values_list(
+                        'user', 'amount_total', 'income_count'):
+                    running[user_id] = [amount_total, income_count]
+            intervals = intervals.filter(start_date__gte=from_date)
+            prefixes = prefixes.filter(interval__start_date__gte=from_date)
+            rollups = rollups.filter(interval__start_date__gte=from_date)
+
+        sums = {(r['interval'], r['user']): (r['amount'], r['count']) for r in rollups.values(
+            'interval', 'user').annotate(amount=Sum('amount_sum'), count=Sum('income_count')).order_by()}
+        prefixes.delete()
+
+        new_prefixes = []
+        for interval_id in intervals.values_list('id', flat=True):
+            for user_id, total in running.items():
+                amount, count = sums.get((interval_id, user_id), (0, 0))
+                total[0] += amount
+                total[1] += count
+                new_prefixes.append(IncomePrefix(interval_id=interval_id, user_id=user_id, amount_total=total[0],
+                                                 income_count=total[1]))
+        IncomePrefix.objects.bulk_create(new_prefixes, batch_size=1000)
+
+
+def add_intervals(intervals):
+    """ Attaches the incomes already dated inside newly created intervals and rolls them up """
+    interval_index.invalidate()
+    bump_versions('intervals')
+    if not intervals:
+        return
+    orphans = Income.objects.filter(
+        interval__isnull=True, date__gte=min(i_o.start_date for i_o in intervals),
+        date__lte=max(i_o.end_date for i_o in intervals)).only('id', 'date', 'interval')
+    assign_income_intervals(orphans)
+    rebuild_income_rollup([i_o.id for i_o in intervals])
+
+
+def move_interval(interval, old_dates, new_dates):
+    """ Reassigns the incomes dated in the old or new (start, end) dates of an interval and rolls them up again """
+    incomes = list(Income.objects.filter(
+        Q(date__range=old_dates) | Q(date__range=new_dates) | Q(interval=interval)).only('id', 'date', 'interval'))
+    interval_ids = {interval.id, *[inc.interval_id for inc in incomes]}
+    assign_income_intervals(incomes)
+    interval_ids.update(inc.interval_id for inc in incomes)
+    rebuild_income_rollup(list(interval_ids - {None}), from_date=min(old_dates[0], new_dates[0]))
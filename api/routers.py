@@ -0,0 +1,105 @@
+import asyncio
+from contextvars import ContextVar
+
+from django.conf import settings
+
+'''
+Read replica routing. The reads of views marked with replica_reads go to the REPLICA_DATABASE_ALIAS database when
+one is configured, and every write goes to default. Once a request writes, its later reads go to default too, and the
+client gets a cookie pinning its reads to default for REPLICA_PIN_SECONDS, so it sees its own writes while the
+replica catches up.
+'''
+
+PIN_COOKIE = 'read_primary'
+
+
+class RoutingState:
+    """ Where the reads of the request being handled go """
+    __slots__ = ['replica', 'wrote']
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+# State of the request being handled. Worker threads running ORM calls for async views inherit it.
+current_routing = ContextVar('current_routing', default=None)
+
+
+def replica_reads(view):
+    """ Marks a read only view function or class whose reads may be served by the replica """
+    view.replica_reads = True
+    return view
+
+
+def is_replica_view(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    return getattr(view_func, 'replica_reads', False) or getattr(view_class, 'replica_reads', False)
+
+
+class ReadReplicaRouter:
+    """ Sends the reads of replica_reads views to the replica until the request writes, see RoutingState """
+
+    def db_for_read(self, model, **hints):
+        state = current_routing.get()
+        if state is not None and state.replica and not state.wrote:
+            return state.replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = current_routing.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as default, so instances read from either can be related
+        dbs = {'default', settings.REPLICA_DATABASE_ALIAS}
+        if obj1._state.db in dbs and obj2._state.db in dbs:  # pylint: disable=protected-access
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sets up the RoutingState of every request: a replica_reads view reads from the replica unless the client
+    carries the pin cookie, and a request that wrote sets the pin cookie.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # pylint: disable=protected-access
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = current_routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = current_routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.pin(state, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = current_routing.get()
+        if state is not None and is_replica_view(view_func) and PIN_COOKIE not in request.COOKIES:
+            state.replica = settings.REPLICA_DATABASE_ALIAS
+
+    @staticmethod
+    def pin(state, response):
+        if state.wrote and settings.REPLICA_DATABASE_ALIAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
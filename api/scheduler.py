@@ -0,0 +1,47 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from api.intervals import roll_intervals
+
+logger = logging.getLogger(__name__)
+
+_started = threading.Event()
+
+
+def run_interval_scheduler(period, ahead_days, stop_event):
+    """ Rolls the intervals over right away and then every period seconds, until stop_event is set """
+    while True:
+        try:
+            created = roll_intervals(ahead_days)
+            if created:
+                logger.info('Created %d intervals up to %s', len(created), created[-1].end_date)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Interval rollover failed')
+        finally:
+            close_old_connections()
+        if stop_event.wait(period):
+            return
+
+
+def start_interval_scheduler(period, ahead_days):
+    """ Starts the in-process interval rollover in a daemon thread, at most once per process """
+    if _started.is_set():
+        return None
+    _started.set()
+    stop_event = threading.Event()
+    threading.Thread(target=run_interval_scheduler, args=(period, ahead_days, stop_event),
+                     name='interval-scheduler', daemon=True).start()
+    return stop_event
+
+
+def start_from_settings():
+    """
+    Starts the interval scheduler when the INTERVAL_SCHEDULER_ENABLED setting is on. Called by the WSGI and ASGI
+    entry points rather than AppConfig.ready, so management commands do not run the scheduler.
+    """
+    if not settings.INTERVAL_SCHEDULER_ENABLED:
+        return None
+    return start_interval_scheduler(settings.INTERVAL_SCHEDULER_PERIOD, settings.INTERVAL_ROLLOVER_AHEAD_DAYS)
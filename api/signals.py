@@ -0,0 +1,82 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from api.interval_index import interval_index
+from api.models import Income, Interval, NumericalParams, Payment, User
+from api.rollup import (
+    add_intervals, apply_income_rows, get_income_rows, move_interval, rebuild_income_prefix, rebuild_income_rollup
+)
+from api.versions import bump_versions
+
+
+@receiver(pre_save, sender=Income)
+def set_income_interval(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_interval_id = Income.objects.filter(pk=instance.pk).values_list('interval', flat=True).first()
+    instance.interval_id = interval_index.lookup(sender._meta.get_field('date').to_python(instance.date))
+
+
+@receiver(post_save, sender=Income)
+def add_income_to_rollup(sender, instance, created, **kwargs):
+    if created:
+        apply_income_rows(get_income_rows([instance]))
+        return
+    interval_ids = {getattr(instance, '_old_interval_id', None), instance.interval_id} - {None}
+    if interval_ids:
+        rebuild_income_rollup(list(interval_ids))
+    else:
+        bump_versions('incomes')
+
+
+@receiver(post_delete, sender=Income)
+def remove_income_from_rollup(sender, instance, **kwargs):
+    apply_income_rows(get_income_rows([instance]), sign=-1)
+
+
+@receiver(pre_save, sender=Interval)
+def remember_interval_dates(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_dates = Interval.objects.filter(pk=instance.pk).values_list('start_date', 'end_date').first()
+
+
+@receiver(post_save, sender=Interval)
+def add_interval_to_rollup(sender, instance, created, **kwargs):
+    if created:
+        add_intervals([instance])
+        return
+    interval_index.invalidate()
+    old_dates = getattr(instance, '_old_dates', None)
+    new_dates = tuple(sender._meta.get_field(name).to_python(getattr(instance, name))
+                      for name in ['start_date', 'end_date'])
+    if old_dates is not None and old_dates != new_dates:
+        move_interval(instance, old_dates, new_dates)
+    bump_versions('intervals')
+
+
+@receiver(post_delete, sender=Interval)
+def remove_interval_from_index(sender, instance, **kwargs):
+    interval_index.invalidate()
+    rebuild_income_prefix(instance.start_date)
+    bump_versions('intervals', 'incomes', 'payments')
+
+
+# Payment deletes bump the version in Payment.delete and PaymentQuerySet.delete, see api/models.py
+@receiver(post_save, sender=Payment)
+def bump_payments_version(sender, **kwargs):
+    bump_versions('payments')
+
+
+@receiver(post_save, sender=NumericalParams)
+@receiver(post_delete, sender=NumericalParams)
+def bump_numerical_params_version(sender, **kwargs):
+    bump_versions('numerical_params')
+
+
+@receiver(post_save, sender=User)
+def bump_users_version(sender, **kwargs):
+    bump_versions('users')
+
+
+@receiver(post_delete, sender=User)
+def remove_user(sender, **kwargs):
+    bump_versions('users', 'payments')
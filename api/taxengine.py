@@ -0,0 +1,101 @@
+import numpy as np
+
+from api.helpers import get_intervals_per_period
+from api.models import IncomePrefix, Interval, User
+
+# Largest magnitude below which int64 to float64 conversion and float division are exact
+EXACT_FLOAT_INT = 2 ** 53
+
+'''
+Applies tax, as api.helpers.apply_tax does, to a matrix of intervals x users for many scenarios at once.
+Input: incomes and present (users apply_tax would get in its dict) of shape (intervals, users),
+    total_taxes of shape (scenarios, intervals) and degrees of shape (scenarios,)
+Output: Tax of shape (scenarios, intervals, users), 0 where a user is not present
+'''
+
+
+def batch_apply_tax(incomes, present, total_taxes, degrees):
+    incomes = np.asarray(incomes, dtype=np.int64)
+    present = np.asarray(present, dtype=bool)
+    total_taxes = np.asarray(total_taxes, dtype=np.int64)
+    degrees = np.asarray(degrees, dtype=np.int64)
+
+    taxes = np.zeros((len(degrees), *incomes.shape), dtype=np.int64)
+    for degree in np.unique(degrees):
+        scenarios = np.flatnonzero(degrees == degree)
+        taxes[scenarios] = _apply_tax_for_degree(incomes, present, total_taxes[scenarios], int(degree))
+    return taxes
+
+
+def _apply_tax_for_degree(incomes, present, total_taxes, degree):
+    exponent = degree + 1
+    max_income = int(np.abs(incomes).max(initial=0))
+    if max_income ** exponent * max(incomes.shape[1], 1) < 2 ** 63:
+        powers = np.where(present, incomes ** exponent, 0)
+    else:  # Falls back to Python integers rather than overflowing int64
+        powers = np.where(present, incomes.astype(object) ** exponent, 0)
+    sums = powers.sum(axis=1)
+
+    # Float division matches Python's exact int / int only while both operands convert to float64 exactly
+    exact = (np.abs(sums.astype(np.float64)) < EXACT_FLOAT_INT)[None, :] & (np.abs(total_taxes) < EXACT_FLOAT_INT)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        div_amounts = total_taxes / sums.astype(np.float64)[None, :]
+    for s_i, i_i in zip(*np.nonzero(~exact)):
+        div_amounts[s_i, i_i] = int(total_taxes[s_i, i_i]) / int(sums[i_i]) if sums[i_i] else 0
+    div_amounts[:, sums == 0] = 0  # apply_tax returns 0 for everyone when all income is 0
+
+    return np.rint(div_amounts[:, :, None] * powers.astype(np.float64)[None, :, :]).astype(np.int64)
+
+
+'''
+Averaged incomes of every interval, ordered by start date, from the per user running totals.
+Output: (intervals, user ids, averaged incomes of shape (intervals, users), present mask of the same shape)
+'''
+
+
+def get_average_income_matrix(intervals_per_period):
+    intervals = list(Interval.objects.order_by('start_date', 'id'))
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    interval_pos = {i_o.id: pos for pos, i_o in enumerate(intervals)}
+    user_pos = {user_id: pos for pos, user_id in enumerate(user_ids)}
+
+    totals = np.zeros((len(intervals) + intervals_per_period, len(user_ids)), dtype=np.int64)
+    counts = np.zeros_like(totals)
+    for interval_id, user_id, amount_total, income_count in IncomePrefix.objects.values_list(
+            'interval', 'user', 'amount_total', 'income_count'):
+        pos = interval_pos[interval_id] + intervals_per_period
+        totals[pos, user_pos[user_id]] = amount_total
+        counts[pos, user_pos[user_id]] = income_count
+
+    # Rows before the first interval are zero, so the window of interval k is rows k + p minus rows k
+    window_totals = totals[intervals_per_period:] - totals[:-intervals_per_period]
+    window_counts = counts[intervals_per_period:] - counts[:-intervals_per_period]
+    averages = np.sign(window_totals) * (np.abs(window_totals) // intervals_per_period)
+    return intervals, user_ids, averages, window_counts > 0
+
+
+'''
+Taxes every interval for each (amount, degree) scenario. An amount of None uses each interval's own amount.
+Output: e.g {'scenarios': [{'amount': 1100, 'degree': 1}], 'intervals': {3: [{'MAL001': 296, 'SRI001': 804}]}}
+'''
+
+
+def simulate_taxes(amounts, degrees, interval_ids=None):
+    intervals, user_ids, averages, present = get_average_income_matrix(get_intervals_per_period())
+    if interval_ids is not None:
+        interval_ids = set(interval_ids)
+        keep = [pos for pos, i_o in enumerate(intervals) if i_o.id in interval_ids]
+        intervals, averages, present = [intervals[pos] for pos in keep], averages[keep], present[keep]
+
+    scenarios = [{'amount': amount, 'degree': degree} for amount in amounts for degree in degrees]
+    own_amounts = [i_o.amount for i_o in intervals]
+    total_taxes = [own_amounts if s['amount'] is None else [s['amount']] * len(intervals) for s in scenarios]
+    taxes = batch_apply_tax(averages, present, np.array(total_taxes, dtype=np.int64).reshape(
+        len(scenarios), len(intervals)), [s['degree'] for s in scenarios])
+
+    results = {}
+    for i_pos, i_o in enumerate(intervals):
+        users = [(u_pos, user_id) for u_pos, user_id in enumerate(user_ids) if present[i_pos, u_pos]]
+        results[i_o.id] = [{user_id: int(taxes[s_pos, i_pos, u_pos]) for u_pos, user_id in users}
+                           for s_pos in range(len(scenarios))]
+    return {'scenarios': scenarios, 'intervals': results}
@@ -0,0 +1,99 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.db.backends.signals import connection_created
+from django.test import Client, RequestFactory, TransactionTestCase
+
+from .. import async_views
+from ..middleware import MetricsMiddleware, request_metrics
+from ..models import User, IncomeSource, Income, Interval, Payment
+
+client = Client()
+factory = RequestFactory()
+
+
+# Worker threads of the async views use their own database connections, which only see committed data
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        for user_id in ['TEST000', 'TEST001']:
+            User.objects.create(id=user_id, name=user_id)
+        self.intervals = [Interval.objects.create(start_date='2021-09-20', end_date='2021-10-03'),
+                          Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')]
+        source0 = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST000')
+        source1 = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST001')
+        Income.objects.create(incomesource=source0, amount=300, date='2021-09-22')
+        Income.objects.create(incomesource=source0, amount=500, date='2021-10-05')
+        Income.objects.create(incomesource=source1, amount=100, date='2021-10-06')
+        Payment.objects.create(interval=self.intervals[0], user_id='TEST000', amount=40)
+
+    def call(self, view, url, *args, **headers):
+        return async_to_sync(view)(factory.get(url, **headers), *args)
+
+    def test_matches_sync_views(self):
+        i_id = str(self.intervals[1].id)
+        views = [
+            (async_views.interval_list, '/api/intervals/', []),
+            (async_views.interval_list, '/api/intervals/?limit=1', []),
+            (async_views.payment, '/api/payment/%s/' % self.intervals[0].id, [str(self.intervals[0].id)]),
+            (async_views.income_per_interval, '/api/income/income-source/%s/' % i_id, [i_id]),
+            (async_views.avg_income_per_interval, '/api/income/averaged/%s' % i_id, [i_id]),
+            (async_views.unsubmitted_users_per_interval, '/api/users/unsubmitted/%s' % i_id, [i_id]),
+            (async_views.interval_dashboard, '/api/interval/%s/dashboard' % i_id, [i_id]),
+            (async_views.total_income, '/api/metrics/total-income?from=2021-10-01', []),
+            (async_views.total_paid, '/api/metrics/total-paid', []),
+            (async_views.total_income_by_interval, '/api/metrics/total-income-by-interval', []),
+            (async_views.total_payment_by_interval, '/api/metrics/total-payment-by-interval', []),
+        ]
+        for view, url, args in views:
+            with self.subTest(url=url):
+                response = self.call(view, url, *args)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), client.get(url).json())
+
+    def test_not_modified(self):
+        etag = self.call(async_views.total_income_by_interval, '/api/metrics/total-income-by-interval')['ETag']
+        response = self.call(async_views.total_income_by_interval, '/api/metrics/total-income-by-interval',
+                             HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_errors(self):
+        self.assertEqual(self.call(async_views.interval_dashboard, '/api/interval/999/dashboard', '999').status_code,
+                         404)
+        self.assertEqual(self.call(async_views.total_paid, '/api/metrics/total-paid?to=soon').status_code, 400)
+        self.assertEqual(self.call(async_views.interval_list, '/api/intervals/?limit=0').status_code, 400)
+
+    def test_only_safe_methods(self):
+        i_id = str(self.intervals[0].id)
+        for view, args in [(async_views.interval_list, []), (async_views.payment, [i_id]),
+                           (async_views.interval_dashboard, [i_id]), (async_views.total_paid, [])]:
+            with self.subTest(view=view.__name__):
+                response = async_to_sync(view)(factory.post('/api/'), *args)
+                self.assertEqual(response.status_code, 405)
+                self.assertEqual(response['Allow'], 'GET, HEAD')
+                self.assertEqual(async_to_sync(view)(factory.head('/api/'), *args).status_code, 200)
+
+    def test_metrics_count_worker_thread_queries(self):
+        request_metrics.reset()
+        middleware = MetricsMiddleware(async_views.total_income_by_interval)
+        async_to_sync(middleware)(factory.get('/api/metrics/total-income-by-interval'))
+        self.assertEqual(request_metrics.snapshot()['routes'][0]['sql']['queries'], 3)
+
+    def test_connections_per_response(self):
+        created = []
+
+        def on_created(sender, connection, **kwargs):
+            created.append(connection)
+        connection_created.connect(on_created)
+        self.addCleanup(connection_created.disconnect, on_created)
+        i_id = str(self.intervals[1].id)
+        # Each view loads its response in one worker thread and its connection, the dashboard also fans out its two
+        # aggregations
+        for view, url, args, connections in [
+            (async_views.avg_income_per_interval, '/api/income/averaged/%s' % i_id, [i_id], 1),
+            (async_views.total_income_by_interval, '/api/metrics/total-income-by-interval', [], 1),
+            (async_views.interval_dashboard, '/api/interval/%s/dashboard' % i_id, [i_id], 3),
+        ]:
+            with self.subTest(url=url):
+                created.clear()
+                self.call(view, url, *args)
+                self.assertLessEqual(len(created), connections)
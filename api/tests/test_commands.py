@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Sum
+from django.test import TestCase
+
+from ..models import User, IncomeSource, Income, Interval, IncomeRollup, Payment, TaxResult
+from ..urls import urlpatterns
+
+
+class ImportIncomesTest(TestCase):
+    def setUp(self):
+        User.objects.create(id='TEST000', name='Test0')
+        User.objects.create(id='TEST001', name='Test1')
+        IncomeSource.objects.create(name='Salary', user_id='TEST000')
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_import_csv_and_ndjson(self):
+        csv_path = self.write_file('incomes.csv', 'user,income_source,amount,date\n'
+                                                  'TEST000,Salary,100,2021-10-05\n'
+                                                  'TEST001,Shop,20,2021-10-06\n'
+                                                  'TEST001,Shop,30,2021-11-06\n')
+        ndjson_path = self.write_file('incomes.ndjson',
+                                      '{"user": "TEST000", "income_source": "Salary", "amount": 5, "date": "2021-10-07"}\n'
+                                      '{"user": "TEST000", "income_source": "Bonus", "amount": 7, "date": "2021-10-08"}\n')
+        call_command('import_incomes', csv_path, ndjson_path, chunk_size=2, stdout=StringIO())
+
+        self.assertEqual(Income.objects.count(), 5)
+        self.assertEqual(IncomeSource.objects.count(), 3)
+        self.assertEqual(Income.objects.filter(interval=self.interval).count(), 4)
+        rollups = IncomeRollup.objects.values_list('incomesource__name', 'user', 'amount_sum', 'income_count')
+        self.assertEqual(sorted(rollups), [('Bonus', 'TEST000', 7, 1), ('Salary', 'TEST000', 105, 2),
+                                           ('Shop', 'TEST001', 20, 1)])
+
+    def test_import_unknown_user(self):
+        path = self.write_file('incomes.csv', 'user,income_source,amount,date\nNOBODY,Salary,100,2021-10-05\n')
+        with self.assertRaisesMessage(CommandError, 'line 2: unknown user'):
+            call_command('import_incomes', path, stdout=StringIO())
+
+
+    def test_import_invalid_json(self):
+        path = self.write_file('incomes.ndjson', '{"user": "TEST000", "income_source": "Salary", "amount": 5, '
+                                                 '"date": "2021-10-07"}\n\n{"user": \n')
+        with self.assertRaisesMessage(CommandError, 'incomes.ndjson line 3: invalid JSON'):
+            call_command('import_incomes', path, chunk_size=1, stdout=StringIO())
+        self.assertEqual(Income.objects.count(), 1)
+
+    def test_import_atomic(self):
+        path = self.write_file('incomes.csv', 'user,income_source,amount,date\nTEST000,Salary,100,2021-10-05\n'
+                                              'NOBODY,Salary,100,2021-10-05\n')
+        with self.assertRaisesMessage(CommandError, 'line 3: unknown user'):
+            call_command('import_incomes', path, chunk_size=1, atomic=True, stdout=StringIO())
+        self.assertEqual(Income.objects.count(), 0)
+        self.assertEqual(IncomeRollup.objects.count(), 0)
+
+
+class DatabaseBackupTest(TestCase):
+    backup_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'database-backup')
+
+    def data_lines(self, path):
+        with open(path, encoding='utf-8') as f:
+            return sorted(line for line in f if not line.startswith('|-'))
+
+    def test_load_and_dump(self):
+        call_command('database_backup', 'load', dir=self.backup_dir, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Income.objects.count(), 198)
+        self.assertEqual(Income.objects.filter(interval__isnull=False).count(),
+                         IncomeRollup.objects.aggregate(Sum('income_count'))['income_count__sum'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            call_command('database_backup', 'dump', dir=tmp_dir, stdout=StringIO())
+            for name in ['user', 'incomesource', 'interval', 'income', 'payment']:
+                self.assertEqual(self.data_lines(os.path.join(tmp_dir, name + '.txt')),
+                                 self.data_lines(os.path.join(self.backup_dir, name + '.txt')))
+
+        with self.assertRaises(CommandError):
+            call_command('database_backup', 'load', dir=self.backup_dir, stdout=StringIO())
+        call_command('database_backup', 'load', dir=self.backup_dir, replace=True, stdout=StringIO())
+        self.assertEqual(Income.objects.count(), 198)
+
+
+class GenerateDataTest(TestCase):
+    def generate(self, **options):
+        call_command('generate_data', users=4, sources_per_user=2, intervals=6, incomes_per_interval=3,
+                     end_date=date(2022, 3, 1), stdout=StringIO(), **options)
+        return list(Income.objects.order_by('date', 'amount').values_list('incomesource__user', 'amount', 'date'))
+
+    def test_generate_data(self):
+        incomes = self.generate()
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(IncomeSource.objects.count(), 8)
+        self.assertEqual(list(Interval.objects.order_by('start_date').values_list('start_date', 'end_date'))[-1],
+                         (date(2022, 2, 16), date(2022, 3, 1)))
+        self.assertEqual(Income.objects.filter(interval__start_date__lt='2022-02-16').count(), 5 * 4 * 3)
+        self.assertEqual(Income.objects.filter(interval__isnull=True).count(), 0)
+        self.assertEqual(IncomeRollup.objects.aggregate(Sum('income_count'))['income_count__sum'], len(incomes))
+        self.assertEqual(Payment.objects.filter(interval__start_date__lt='2022-02-16').count(), 5 * 4)
+
+        with self.assertRaises(CommandError):
+            self.generate()
+        self.assertEqual(self.generate(replace=True), incomes)
+
+
+class BenchmarkTest(TestCase):
+    def test_benchmark_every_route(self):
+        call_command('generate_data', users=3, intervals=4, stdout=StringIO())
+        counts = [model.objects.count() for model in [Income, Payment, TaxResult]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'benchmark.json')
+            call_command('benchmark', repeat=2, output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as f:
+                report = json.load(f)
+
+        self.assertEqual(report['missing_routes'], [])
+        self.assertEqual({r['route'] for r in report['routes']}, {str(p.pattern) for p in urlpatterns})
+        for result in report['routes']:
+            self.assertLess(result['status'], 400, result['route'])
+            self.assertEqual(len(result['queries']), 2)
+        # The tax routes store payments and tax results even for a GET
+        self.assertEqual([model.objects.count() for model in [Income, Payment, TaxResult]], counts)
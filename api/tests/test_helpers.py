@@ -0,0 +1,31 @@
+from django.test import TestCase
+
+from ..helpers import submit_income_as_payment
+from ..models import User, Interval, Payment
+
+
+class SubmitIncomeAsPaymentTest(TestCase):
+    def setUp(self):
+        for i in range(3):
+            User.objects.create(id='TEST00' + str(i), name='Test' + str(i))
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+        Payment.objects.create(interval=self.interval, user_id='TEST000', amount=10)
+        Payment.objects.create(interval=self.interval, user_id='TEST001', amount=20)
+
+    def payments(self):
+        return dict(Payment.objects.filter(interval=self.interval).values_list('user', 'amount'))
+
+    def test_only_changed_rows_are_written(self):
+        counts = submit_income_as_payment(self.interval.id, {'TEST001': 25, 'TEST002': 30})
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1, 'deleted': 1})
+        self.assertEqual(self.payments(), {'TEST001': 25, 'TEST002': 30})
+
+        # Savepoint, interval lock, select, release savepoint
+        with self.assertNumQueries(4):
+            counts = submit_income_as_payment(self.interval.id, {'TEST001': 25, 'TEST002': 30})
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'deleted': 0})
+
+    def test_not_all_income_submitted(self):
+        counts = submit_income_as_payment(self.interval.id, {'TEST001': 25}, all_income_submitted=False)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'deleted': 2})
+        self.assertEqual(self.payments(), {})
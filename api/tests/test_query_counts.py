@@ -0,0 +1,62 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+
+from ..datagen import clear_data, generate_dataset
+from ..management.commands.benchmark import API_PREFIX, get_requests, get_sample
+from ..urls import urlpatterns
+
+# Dataset sizes every route is requested at, the second one with ten times the users and twenty times the intervals
+SMALL = {'users': 5, 'intervals': 10}
+LARGE = {'users': 50, 'intervals': 200}
+# Routes rewriting a whole table, whose bulk inserts are split in batches of a fixed number of rows
+BATCHED_INSERT_ROUTES = {('POST', 'tax/recompute/')}
+
+
+def collapse_batches(sqls):
+    """ Counts back to back inserts into the same table as one query """
+    collapsed = []
+    for sql in sqls:
+        if not (collapsed and sql.startswith('INSERT') and sql.split('(')[0] == collapsed[-1].split('(')[0]):
+            collapsed.append(sql)
+    return collapsed
+
+
+class QueryCountTest(TestCase):
+    """ Every route must make as many queries on the large dataset as on the small one """
+
+    def measure(self, size):
+        clear_data()
+        generate_dataset(size['users'], sources_per_user=2, intervals=size['intervals'], incomes_per_interval=1)
+
+        queries = {}
+        for route, method, path, body, admin in get_requests(get_sample()):
+            # Rolled back, so every request sees the freshly generated data and no warmed up caches
+            with transaction.atomic():
+                client = Client()
+                if admin:
+                    client.force_login(get_user_model().objects.create_superuser('query-count-admin'))
+                with CaptureQueriesContext(connection) as ctx:
+                    response = client.generic(method, API_PREFIX + path, '' if body is None else json.dumps(body),
+                                              content_type='application/json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400, method + ' ' + route)
+                queries[(method, route)] = [q['sql'] for q in ctx.captured_queries]
+                transaction.set_rollback(True)
+        return queries
+
+    def test_query_count_does_not_grow(self):
+        small = self.measure(SMALL)
+        large = self.measure(LARGE)
+        self.assertEqual({route for _, route in small}, {str(p.pattern) for p in urlpatterns})
+
+        for (method, route), sqls in large.items():
+            if (method, route) in BATCHED_INSERT_ROUTES:
+                sqls, small[(method, route)] = collapse_batches(sqls), collapse_batches(small[(method, route)])
+            with self.subTest(method=method, route=route):
+                self.assertLessEqual(len(sqls), len(small[(method, route)]), '%s %s made %d queries, up from %d:\n%s' % (
+                    method, route, len(sqls), len(small[(method, route)]), '\n'.join(sqls)))
@@ -0,0 +1,102 @@
+import json
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client
+
+from ..interval_index import interval_index
+from ..models import User, IncomeSource, Income, Interval, IncomePrefix, IncomeRollup
+from ..versions import bump_versions
+
+client = Client()
+
+
+class IncomeRollupTest(TestCase):
+    def setUp(self):
+        User.objects.create(id='TEST000', name='Test0')
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+        self.income_source = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST000')
+
+    def rollup_values(self):
+        return list(IncomeRollup.objects.values_list('interval', 'user', 'incomesource', 'amount_sum', 'income_count'))
+
+    def test_post_and_delete_income(self):
+        for amount in [100, 250]:
+            client.post('/api/income/', json.dumps({'incomesource': self.income_source.id, 'amount': amount,
+                                                    'date': '2021-10-07'}), content_type='application/json')
+        self.assertEqual(self.rollup_values(), [(self.interval.id, 'TEST000', self.income_source.id, 350, 2)])
+
+        for income in Income.objects.all():
+            client.delete('/api/income/' + str(income.id))
+        self.assertEqual(self.rollup_values(), [])
+
+    def test_delete_user_with_incomes(self):
+        User.objects.create(id='TEST001', name='Test1')
+        other_source = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST001')
+        Income.objects.create(incomesource_id=self.income_source.id, amount=500, date='2021-10-07')
+        Income.objects.create(incomesource_id=other_source.id, amount=300, date='2021-10-08')
+
+        User.objects.get(id='TEST000').delete()
+        connection.check_constraints()
+        self.assertEqual(self.rollup_values(), [(self.interval.id, 'TEST001', other_source.id, 300, 1)])
+        self.assertEqual(list(IncomePrefix.objects.values_list('user', 'amount_total')), [('TEST001', 300)])
+
+    def test_interval_created_after_income(self):
+        Income.objects.create(incomesource_id=self.income_source.id, amount=500, date='2021-10-20')
+        later_interval = Interval.objects.create(start_date='2021-10-18', end_date='2021-10-31')
+        self.assertEqual(self.rollup_values(), [(later_interval.id, 'TEST000', self.income_source.id, 500, 1)])
+
+    def test_interval_dates_changed(self):
+        income = Income.objects.create(incomesource_id=self.income_source.id, amount=500, date='2021-10-20')
+        later_interval = Interval.objects.create(start_date='2021-11-01', end_date='2021-11-14')
+        self.assertEqual(self.rollup_values(), [])
+
+        later_interval.start_date, later_interval.end_date = '2021-10-18', '2021-10-31'
+        later_interval.save()
+        self.assertEqual(Income.objects.get(pk=income.pk).interval_id, later_interval.id)
+        self.assertEqual(self.rollup_values(), [(later_interval.id, 'TEST000', self.income_source.id, 500, 1)])
+        self.assertEqual(set(IncomePrefix.objects.values_list('interval', 'amount_total')),
+                         {(self.interval.id, 0), (later_interval.id, 500)})
+
+        later_interval.start_date, later_interval.end_date = '2021-09-20', '2021-10-03'
+        later_interval.save()
+        self.assertIsNone(Income.objects.get(pk=income.pk).interval_id)
+        self.assertEqual(self.rollup_values(), [])
+        self.assertEqual(set(IncomePrefix.objects.values_list('interval', 'amount_total')),
+                         {(self.interval.id, 0), (later_interval.id, 0)})
+
+    def test_income_interval_assigned_on_save(self):
+        later_interval = Interval.objects.create(start_date='2021-10-18', end_date='2021-10-31')
+        income = Income.objects.create(incomesource_id=self.income_source.id, amount=500, date='2021-10-17')
+        self.assertEqual(income.interval_id, self.interval.id)
+
+        income.date = '2021-10-18'
+        income.save()
+        self.assertEqual(Income.objects.get(pk=income.pk).interval_id, later_interval.id)
+        self.assertEqual(self.rollup_values(), [(later_interval.id, 'TEST000', self.income_source.id, 500, 1)])
+
+    def test_rebuild_command(self):
+        Income.objects.create(incomesource_id=self.income_source.id, amount=500, date='2021-10-07')
+        Income.objects.create(incomesource_id=self.income_source.id, amount=20, date='2021-10-08')
+        expected = self.rollup_values()
+        IncomeRollup.objects.all().delete()
+        Income.objects.update(interval=None)
+        call_command('rebuild_income_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup_values(), expected)
+        self.assertEqual(expected, [(self.interval.id, 'TEST000', self.income_source.id, 520, 2)])
+
+
+# Boundaries are only cached outside of transactions
+class IntervalIndexTest(TransactionTestCase):
+    def test_interval_moved_by_another_process(self):
+        self.addCleanup(interval_index.invalidate)
+        interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+        self.assertEqual(interval_index.lookup(date(2021, 10, 7)), interval.id)
+
+        # Another process sends no signal to this one, only the version it bumped tells the cache is stale
+        Interval.objects.filter(pk=interval.pk).update(start_date='2021-10-18', end_date='2021-10-31')
+        bump_versions('intervals')
+        self.assertIsNone(interval_index.lookup(date(2021, 10, 7)))
+        self.assertEqual(interval_index.lookup(date(2021, 10, 20)), interval.id)
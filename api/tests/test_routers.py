@@ -0,0 +1,79 @@
+import json
+
+from django.db.utils import ConnectionDoesNotExist
+from django.test import Client, TestCase, override_settings
+
+from .. import async_views, views
+from ..models import User, Interval, Payment
+from ..routers import PIN_COOKIE, ReadReplicaRouter, RoutingState, current_routing, is_replica_view
+
+router = ReadReplicaRouter()
+
+
+@override_settings(REPLICA_DATABASE_ALIAS='replica')
+class ReadReplicaRouterTest(TestCase):
+    def route(self, state):
+        token = current_routing.set(state)
+        try:
+            return router.db_for_read(User), router.db_for_write(User), router.db_for_read(User)
+        finally:
+            current_routing.reset(token)
+
+    def test_outside_of_requests(self):
+        self.assertEqual(self.route(None), (None, 'default', None))
+
+    def test_reads_after_a_write_stick_to_default(self):
+        state = RoutingState()
+        state.replica = 'replica'
+        self.assertEqual(self.route(state), ('replica', 'default', None))
+        self.assertTrue(state.wrote)
+
+    def test_relations_across_replica_and_default(self):
+        user, interval = User(id='TEST000'), Interval()
+        user._state.db, interval._state.db = 'replica', 'default'  # pylint: disable=protected-access
+        self.assertTrue(router.allow_relation(user, interval))
+        interval._state.db = 'other'  # pylint: disable=protected-access
+        self.assertIsNone(router.allow_relation(user, interval))
+
+    def test_read_views_are_marked(self):
+        for view in [views.IntervalLatestListView.as_view(), views.payment, views.income_per_interval,
+                     views.avg_income_per_interval, views.unsubmitted_users_per_interval, views.total_income,
+                     views.total_paid, views.total_income_by_interval, views.total_payment_by_interval,
+                     async_views.interval_list, async_views.total_income]:
+            self.assertTrue(is_replica_view(view), view.__name__)
+        # The tax and dashboard views store payments and tax results computed from what they read
+        for view in [views.PaymentView.as_view(), views.recompute_payments, views.numerical_params, views.tax,
+                     views.interval_dashboard, async_views.interval_dashboard]:
+            self.assertFalse(is_replica_view(view), view.__name__)
+
+
+# There is no replica alias in the tests, so a read routed to it raises ConnectionDoesNotExist
+@override_settings(REPLICA_DATABASE_ALIAS='replica')
+class ReplicaRoutingMiddlewareTest(TestCase):
+    def setUp(self):
+        User.objects.create(id='TEST000', name='Test')
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+
+    def test_read_views_read_from_the_replica(self):
+        with self.assertRaises(ConnectionDoesNotExist):
+            Client().get('/api/metrics/total-paid')
+        self.assertEqual(Client().get('/api/users/').status_code, 200)
+
+    def test_writes_pin_reads_to_default(self):
+        client = Client()
+        response = client.post('/api/payment/', json.dumps({'interval': self.interval.id, 'user': 'TEST000',
+                                                            'amount': 5}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        response = client.get('/api/payment/%d/' % self.interval.id)
+        self.assertEqual(response.json(), {'TEST000': 5.0})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_no_pin_without_replica(self):
+        with self.settings(REPLICA_DATABASE_ALIAS=None):
+            response = Client().post('/api/payment/', json.dumps({'interval': self.interval.id, 'user': 'TEST000',
+                                                                   'amount': 5}), content_type='application/json')
+            self.assertEqual(Client().get('/api/metrics/total-paid').status_code, 200)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
@@ -0,0 +1,101 @@
+import json
+import random
+from io import StringIO
+
+from django.contrib.auth.models import User as AuthUser
+from django.core.management import call_command
+from django.test import TestCase, Client
+
+from ..helpers import apply_tax, get_tax_dict
+from ..models import User, IncomeSource, Income, Interval, Payment
+from ..taxengine import batch_apply_tax
+
+client = Client()
+
+
+class BatchApplyTaxTest(TestCase):
+    def assert_matches_apply_tax(self, incomes, present, total_taxes, degrees):
+        taxes = batch_apply_tax(incomes, present, total_taxes, degrees)
+        for s_i, degree in enumerate(degrees):
+            for i_i, row in enumerate(incomes):
+                user_dict = {u_i: income for u_i, income in enumerate(row) if present[i_i][u_i]}
+                expected = apply_tax(user_dict, total_taxes[s_i][i_i], degree)
+                self.assertEqual({u_i: int(taxes[s_i, i_i, u_i]) for u_i in user_dict}, expected)
+
+    def test_matches_apply_tax(self):
+        rng = random.Random(7)
+        incomes = [[rng.randint(0, 5000) for _ in range(5)] for _ in range(40)]
+        present = [[rng.random() > 0.2 for _ in range(5)] for _ in range(40)]
+        incomes[3] = [0] * 5
+        degrees = [0, 1, 2, 3, 1]
+        total_taxes = [[rng.randint(0, 3000) for _ in range(40)] for _ in degrees]
+        self.assert_matches_apply_tax(incomes, present, total_taxes, degrees)
+
+    def test_matches_apply_tax_beyond_int64(self):
+        incomes = [[3 * 10 ** 6, 10 ** 6 + 1, 7], [10 ** 9, 2, 0]]
+        present = [[True, True, True], [True, True, False]]
+        self.assert_matches_apply_tax(incomes, present, [[1100, 2 ** 60]] * 2, [1, 4])
+
+
+class TaxHistoryTestCase(TestCase):
+    def create_models(self):
+        for i in range(3):
+            user = User.objects.create(id='TEST00' + str(i), name='Test' + str(i))
+            IncomeSource.objects.create(name='TestIncomeSource', user_id=user.id)
+        intervals = [Interval.objects.create(start_date='2021-09-20', end_date='2021-10-03'),
+                     Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')]
+        for i, income_source in enumerate(IncomeSource.objects.order_by('user_id')):
+            Income.objects.create(incomesource=income_source, amount=500 * (i + 1), date='2021-10-07')
+            Income.objects.create(incomesource=income_source, amount=300 + i, date='2021-09-23')
+        return intervals
+
+
+class SimulateTaxTest(TaxHistoryTestCase):
+    def simulate(self, body):
+        return client.post('/api/tax/simulate/', json.dumps(body), content_type='application/json')
+
+    def test_requires_admin(self):
+        self.assertEqual(self.simulate({'degrees': [1]}).status_code, 403)
+
+    def test_simulate_matches_tax(self):
+        intervals = self.create_models()
+        client.force_login(AuthUser.objects.create(username='admin', is_staff=True))
+        response = self.simulate({'amounts': [None, 900], 'degrees': [1, 2]})
+        client.logout()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['scenarios'], [{'amount': None, 'degree': 1}, {'amount': None, 'degree': 2},
+                                                      {'amount': 900, 'degree': 1}, {'amount': 900, 'degree': 2}])
+        self.assertEqual(response.data['intervals'][intervals[1].id][0], get_tax_dict(intervals[1].id))
+        self.assertEqual(response.data['intervals'][intervals[1].id][3],
+                         apply_tax({'TEST000': 400, 'TEST001': 650, 'TEST002': 901}, 900, 2))
+
+
+    def test_bad_input(self):
+        client.force_login(AuthUser.objects.create(username='admin', is_staff=True))
+        for body in [{'degrees': [1000]}, {'degrees': [-1]}, {'amounts': [2 ** 64]}, {'intervals': [[1]]},
+                     {'intervals': ['1']}, {'intervals': 1}, {'amounts': [True]}, {'degrees': [False]}, [1], 'amounts']:
+            with self.subTest(body=body):
+                self.assertEqual(self.simulate(body).status_code, 400)
+        client.logout()
+
+
+class RecomputePaymentsTest(TaxHistoryTestCase):
+    def test_recompute_matches_tax(self):
+        intervals = self.create_models()
+        Interval.objects.create(start_date='2021-10-18', end_date='2021-10-31')
+        Payment.objects.create(interval=intervals[0], user_id='TEST000', amount=999)
+
+        call_command('recompute_payments', stdout=StringIO())
+        recomputed = {i_o.id: dict(Payment.objects.filter(interval=i_o).values_list('user', 'amount'))
+                      for i_o in Interval.objects.all()}
+
+        expected = {}
+        for i_o in Interval.objects.all():
+            response = client.get('/api/tax/' + str(i_o.id) + '/')
+            expected[i_o.id] = response.data
+        self.assertEqual(recomputed, expected)
+        self.assertEqual(Payment.objects.count(), 6)
+
+    def test_recompute_endpoint_requires_admin(self):
+        self.assertEqual(client.post('/api/tax/recompute/').status_code, 403)
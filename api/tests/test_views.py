@@ -1,11 +1,23 @@
 import json
+import threading
 from datetime import date, timedelta
+from io import StringIO
 
+from django.contrib.auth.models import User as AuthUser
+from django.core.management import call_command
+from django.db import connection
 from django.forms.models import model_to_dict
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
-from ..models import User, IncomeSource, Income, Interval, Payment, NumericalParams
+from ..helpers import (
+    get_average_window, get_income_per_source, get_intervals_per_period, get_tax_version, submit_income_as_payment
+)
+from ..middleware import request_metrics
+from ..scheduler import run_interval_scheduler, start_from_settings
+from ..models import User, IncomeSource, Income, Interval, Payment, NumericalParams, TaxResult
+from ..views import build_dashboard
 
 # pylint: disable=no-self-use
 
@@ -64,6 +76,36 @@ class IncomeTest(TestCase):
         self.assertEqual(inc_from_db, income_obj)
 
 
+class IncomeBatchTest(TestCase):
+    def setUp(self):
+        User.objects.create(id='TEST000', name='Test')
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+        self.income_source = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST000')
+
+    def post_batch(self, incomes):
+        return client.post('/api/income/batch/', json.dumps(incomes), content_type='application/json')
+
+    def test_post_income_batch(self):
+        incomes = [{'incomesource': self.income_source.id, 'amount': 10 * i, 'date': '2021-10-0' + str(i)}
+                   for i in range(4, 10)]
+        response = self.post_batch(incomes)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([{k: row[k] for k in ['incomesource', 'amount', 'date']} for row in response.data], incomes)
+        self.assertEqual(Income.objects.filter(interval=self.interval).count(), 6)
+        self.assertEqual(client.get('/api/users/unsubmitted/' + str(self.interval.id)).data, [])
+
+        response = client.get('/api/income/income-source/' + str(self.interval.id) + '/')
+        self.assertEqual(response.data['TEST000']['TestIncomeSource']['amount'], 390)
+
+    def test_post_invalid_income_batch(self):
+        response = self.post_batch([{'incomesource': self.income_source.id, 'amount': 10, 'date': '2021-10-04'},
+                                    {'incomesource': self.income_source.id, 'amount': 'ten', 'date': '2021-10-04'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('amount', response.data[1])
+        self.assertEqual(Income.objects.count(), 0)
+
+
 class PaymentTest(TestCase):
     def setUp(self):
         User.objects.create(id='TEST000', name='Test')
@@ -120,7 +162,10 @@ class IntervalListTest(TestCase):
 
     def test_get_intervals(self):
         expected_amount = self.create_intervals()
-        client.get('/api/intervals/', follow=True)
+        response = client.get('/api/intervals/', follow=True)
+        self.assertEqual(len(response.data), 2)
+
+        call_command('create_intervals', stdout=StringIO())
         s_d = date.today()
         i_s = Interval.objects.all().order_by('-end_date')
         self.assertEqual(
@@ -133,6 +178,85 @@ class IntervalListTest(TestCase):
         self.assertEqual(l_i.end_date, s_d + timedelta(8))
         self.assertEqual(l_i.start_date, s_d - timedelta(5))
 
+    def test_create_intervals_ahead(self):
+        self.create_intervals()
+        call_command('create_intervals', ahead_days=14, stdout=StringIO())
+        l_i = Interval.objects.order_by('-end_date').first()
+        self.assertEqual(l_i.end_date, date.today() + timedelta(22))
+
+    def test_interval_scheduler_rolls_over_right_away(self):
+        self.create_intervals()
+        stop_event = threading.Event()
+        stop_event.set()
+        run_interval_scheduler(60, 0, stop_event)
+        self.assertEqual(Interval.objects.order_by('-end_date').first().end_date, date.today() + timedelta(8))
+
+    def test_interval_scheduler_not_started_when_disabled(self):
+        with self.settings(INTERVAL_SCHEDULER_ENABLED=False):
+            self.assertIsNone(start_from_settings())
+
+    def rollover_queries(self, days_idle):
+        Interval.objects.all().delete()
+        s_d = date.today() - timedelta(days_idle)
+        Interval.objects.create(start_date=s_d - timedelta(13), end_date=s_d)
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('create_intervals', stdout=StringIO())
+        return len(ctx.captured_queries)
+
+    def test_rollover_after_long_gap(self):
+        self.create_intervals()
+        self.assertEqual(self.rollover_queries(20), self.rollover_queries(400))
+        self.assertEqual(Interval.objects.count(), 30)
+
+        call_command('create_intervals', stdout=StringIO())
+        self.assertEqual(Interval.objects.count(), 30)
+        self.assertEqual(len(set(Interval.objects.values_list('start_date', flat=True))), 30)
+
+
+class IntervalPageTest(TestCase):
+    def setUp(self):
+        # Seven back to back intervals, the last one starting on 2021-03-26
+        for i in range(7):
+            Interval.objects.create(start_date=date(2021, 1, 1) + timedelta(14 * i),
+                                    end_date=date(2021, 1, 14) + timedelta(14 * i))
+        self.latest_first = list(Interval.objects.order_by('-end_date').values_list('id', flat=True))
+
+    def get_page(self, query):
+        response = client.get('/api/intervals/?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [i['id'] for i in response.data['results']], response.data['next'], response.data['previous']
+
+    def test_pages(self):
+        ids, next_cursor, previous_cursor = self.get_page('limit=3')
+        self.assertEqual((ids, previous_cursor), (self.latest_first[:3], None))
+
+        ids, next_cursor, previous_cursor = self.get_page('limit=3&after=' + next_cursor)
+        self.assertEqual(ids, self.latest_first[3:6])
+        ids, last_cursor, _ = self.get_page('limit=3&after=' + next_cursor)
+        self.assertEqual((ids, last_cursor), (self.latest_first[6:], None))
+
+        ids, _, previous_cursor = self.get_page('limit=3&before=' + previous_cursor)
+        self.assertEqual((ids, previous_cursor), (self.latest_first[:3], None))
+
+    def test_page_query_count(self):
+        with self.assertNumQueries(2):
+            self.get_page('limit=2')
+        with self.assertNumQueries(2):
+            self.get_page('after=2021-03-11_' + str(self.latest_first[1]))
+
+    def test_date_range(self):
+        response = client.get('/api/intervals/?from=2021-01-15&to=2021-02-25')
+        self.assertEqual([i['start_date'] for i in response.data], ['2021-02-12', '2021-01-29', '2021-01-15'])
+        ids, next_cursor, _ = self.get_page('from=2021-01-15&to=2021-02-25&limit=2')
+        self.assertEqual(ids, self.latest_first[3:5])
+        self.assertEqual(self.get_page('from=2021-01-15&to=2021-02-25&limit=2&after=' + next_cursor)[:2],
+                         (self.latest_first[5:6], None))
+
+    def test_bad_page_params(self):
+        for query in ['limit=0', 'limit=ten', 'after=yesterday', 'after=2021-03-11_1&before=2021-03-11_1',
+                      'from=soon']:
+            self.assertEqual(client.get('/api/intervals/?' + query).status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class UserIncomeSourceListTest(TestCase):
     """ GET the sources of income given an user's Id"""
@@ -222,6 +346,29 @@ class TaxTest(TestCase):
         self.assertEqual(response.data, {'TEST000': 1019, 'TEST001': 41, 'TEST002': 41})
         self.assertEqual(len(Payment.objects.all()), 3)
 
+    def test_repeat_tax_is_cached(self):
+        target_interval = self.create_models()
+        url = '/api/tax/' + str(target_interval.id) + '/'
+        client.get(url)
+        Payment.objects.filter(user_id='TEST002').update(amount=1)
+
+        response = client.get(url)
+        self.assertEqual(response.data, {'TEST000': 1019, 'TEST001': 41, 'TEST002': 41})
+        self.assertEqual(Payment.objects.get(user_id='TEST002').amount, 1)
+
+    def test_tax_recomputed_after_change(self):
+        target_interval = self.create_models()
+        url = '/api/tax/' + str(target_interval.id) + '/'
+        client.get(url)
+
+        Income.objects.create(incomesource=IncomeSource.objects.get(user_id='TEST001'), amount=1500, date='2021-10-08')
+        self.assertEqual(client.get(url).data, {'TEST000': 655, 'TEST001': 419, 'TEST002': 26})
+
+        client.patch('/api/interval/' + str(target_interval.id) + '/amount/', json.dumps({'amount': 2200}),
+                     content_type='application/json')
+        self.assertEqual(client.get(url).data, {'TEST000': 1310, 'TEST001': 838, 'TEST002': 52})
+        self.assertEqual(Payment.objects.get(user_id='TEST000').amount, 1310)
+
     def test_with_no_user_income(self):
 
         user0 = User.objects.create(id='TEST000', name='Test0')
@@ -254,6 +401,53 @@ class TaxTest(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class IntervalDashboardTest(TaxTest):
+    def test_dashboard_matches_interval_routes(self):
+        target_interval = self.create_models()
+        url = '/api/interval/' + str(target_interval.id) + '/dashboard'
+        self.assertEqual(client.get(url).data['tax'], {'TEST000': 1019, 'TEST001': 41, 'TEST002': 41})
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.data['interval']['id'], target_interval.id)
+        self.assertTrue(response.data['all_income_submitted'])
+        self.assertEqual(len(ctx.captured_queries), 9)
+        self.assertGreater(len(self.routes_queries(target_interval.id, response.data)), 9)
+
+    def routes_queries(self, interval_id, dashboard):
+        routes = {'tax': '/api/tax/%d/', 'payment': '/api/payment/%d/',
+                  'income_per_source': '/api/income/income-source/%d/', 'averaged_income': '/api/income/averaged/%d',
+                  'unsubmitted_users': '/api/users/unsubmitted/%d'}
+        with CaptureQueriesContext(connection) as ctx:
+            for key, url in routes.items():
+                self.assertEqual(client.get(url % interval_id).data, dashboard[key], key)
+        return ctx.captured_queries
+
+    def test_dashboard_with_missing_income(self):
+        self.create_models()
+        later_interval = Interval.objects.get(start_date='2021-10-18')
+        response = client.get('/api/interval/' + str(later_interval.id) + '/dashboard')
+        self.assertFalse(response.data['all_income_submitted'])
+        self.assertEqual(response.data['tax'], {})
+        self.assertEqual(response.data['unsubmitted_users'], ['TEST000', 'TEST001', 'TEST002'])
+        self.assertEqual(response.data['averaged_income'], {'TEST000': 250, 'TEST001': 250, 'TEST002': 250})
+
+    def test_dashboard_stores_the_version_read_before_its_inputs(self):
+        target_interval = self.create_models()
+        intervals_per_period = get_intervals_per_period()
+        window = get_average_window(target_interval, intervals_per_period)
+        version = get_tax_version(target_interval, window[:intervals_per_period])
+        Income.objects.create(incomesource=IncomeSource.objects.get(user_id='TEST001'), amount=1500, date='2021-10-08')
+
+        dashboard = build_dashboard(target_interval, intervals_per_period, window, version,
+                                    get_income_per_source(target_interval), User.objects.values_list('id', flat=True))
+        self.assertEqual(dashboard['tax'], {'TEST000': 655, 'TEST001': 419, 'TEST002': 26})
+        self.assertEqual(TaxResult.objects.get(interval=target_interval).version, version)
+        self.assertNotEqual(get_tax_version(target_interval, window[:intervals_per_period]), version)
+
+    def test_dashboard_missing_interval(self):
+        self.assertEqual(client.get('/api/interval/999/dashboard').status_code, status.HTTP_404_NOT_FOUND)
+
+
 class IncomePerInterval(TestCase):
     def create_models(self):
         user0 = User.objects.create(id='TEST000', name='Test0')
@@ -298,6 +492,13 @@ class IncomePerInterval(TestCase):
         self.assertEqual(data['TEST002']['AnotherIncomeSource']['amount'], 123)
         self.assertEqual(len(data['TEST002']['AnotherIncomeSource']['ids']), 1)
 
+    def test_income_per_interval_query_count(self):
+        target_interval = self.create_models()
+        with self.assertNumQueries(2):
+            response = client.get('/api/income/income-source/' + str(target_interval.id) + '/')
+        inc_ids = list(Income.objects.filter(incomesource__user_id='TEST000').order_by('id').values_list('id', flat=True))
+        self.assertEqual(response.data['TEST000']['TestIncomeSource'], {'amount': 1000, 'ids': inc_ids})
+
 
 class IncomeAvgPerInterval(IncomePerInterval):
     def test_avg_income_per_interval_when_all_users_submitted(self):
@@ -309,6 +510,50 @@ class IncomeAvgPerInterval(IncomePerInterval):
                 'TEST000': 500, 'TEST001': 250, 'TEST002': 311})
 
 
+class IncomeAvgPerIntervalWindow(TestCase):
+    def create_models(self):
+        user0 = User.objects.create(id='TEST000', name='Test0')
+        user1 = User.objects.create(id='TEST001', name='Test1')
+        income_source0 = IncomeSource.objects.create(name='TestIncomeSource', user_id=user0.id)
+        income_source1 = IncomeSource.objects.create(name='TestIncomeSource', user_id=user1.id)
+
+        intervals = [Interval.objects.create(start_date=date(2021, 9, 6) + timedelta(14 * i),
+                                             end_date=date(2021, 9, 19) + timedelta(14 * i)) for i in range(5)]
+        for i, i_o in enumerate(intervals):
+            Income.objects.create(incomesource_id=income_source0.id, amount=100 * (i + 1), date=i_o.start_date)
+        Income.objects.create(incomesource_id=income_source1.id, amount=7, date=intervals[0].end_date)
+        return intervals
+
+    def test_window_from_numerical_params(self):
+        intervals = self.create_models()
+        NumericalParams.objects.filter(key='intervals_per_period').update(value=3)
+        response = client.get('/api/income/averaged/' + str(intervals[3].id))
+        self.assertEqual(response.data, {'TEST000': 300})
+        response = client.get('/api/income/averaged/' + str(intervals[2].id))
+        self.assertEqual(response.data, {'TEST000': 200, 'TEST001': 2})
+
+    def test_window_below_one_interval(self):
+        intervals = self.create_models()
+        response = client.patch('/api/numerical-params/', json.dumps({'key': 'intervals_per_period', 'value': 0}),
+                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        NumericalParams.objects.filter(key='intervals_per_period').update(value=0)
+        response = client.get('/api/income/averaged/' + str(intervals[3].id))
+        self.assertEqual(response.data, {'TEST000': 400})
+
+    def test_window_after_income_changes(self):
+        intervals = self.create_models()
+        Income.objects.filter(amount=400).delete()
+        Income.objects.create(incomesource=IncomeSource.objects.get(user_id='TEST001'), amount=11,
+                              date=intervals[4].end_date)
+        response = client.get('/api/income/averaged/' + str(intervals[4].id))
+        self.assertEqual(response.data, {'TEST000': 250, 'TEST001': 5})
+
+        Interval.objects.create(start_date=date(2021, 8, 23), end_date=date(2021, 9, 5))
+        response = client.get('/api/income/averaged/' + str(intervals[4].id))
+        self.assertEqual(response.data, {'TEST000': 250, 'TEST001': 5})
+
+
 class UsersUnsubmittedPerInterval(TestCase):
     def create_models(self):
         user0 = User.objects.create(id='TEST000', name='Test0')
@@ -327,6 +572,12 @@ class UsersUnsubmittedPerInterval(TestCase):
         response = client.get('/api/users/unsubmitted/' + str(target_interval.id), follow=True)
         self.assertEqual(response.data, ['TEST001', 'TEST002'])
 
+    def test_unsubmitted_users_single_query(self):
+        target_interval = self.create_models()
+        with self.assertNumQueries(1):
+            response = client.get('/api/users/unsubmitted/' + str(target_interval.id))
+        self.assertEqual(response.data, ['TEST001', 'TEST002'])
+
 
 class TotalIncome(TestCase):
     def create_models(self):
@@ -356,6 +607,17 @@ class TotalIncome(TestCase):
         response = client.get('/api/metrics/total-income', follow=True)
         self.assertEqual(response.data, {'TEST000': 600, 'TEST001': 800, 'TEST002': 2200})
 
+    def test_total_income_in_date_window(self):
+        self.create_models()
+        User.objects.create(id='TEST003', name='Test3')
+        with self.assertNumQueries(2):
+            response = client.get('/api/metrics/total-income?from=2021-09-24&to=2021-10-07', follow=True)
+        self.assertEqual(response.data, {'TEST000': 100, 'TEST001': 800, 'TEST002': 2200, 'TEST003': None})
+
+    def test_total_income_bad_date(self):
+        response = client.get('/api/metrics/total-income?from=yesterday', follow=True)
+        self.assertEqual(response.status_code, 400)
+
 
 class TotalPaid(TestCase):
 
@@ -379,6 +641,12 @@ class TotalPaid(TestCase):
         response = client.get('/api/metrics/total-paid', follow=True)
         self.assertEqual(response.data, {'TEST000': 50, 'TEST001': 70, 'TEST002': 90})
 
+    def test_total_paid_in_date_window(self):
+        self.create_models()
+        User.objects.create(id='TEST003', name='Test3')
+        response = client.get('/api/metrics/total-paid?from=2022-01-01', follow=True)
+        self.assertEqual(response.data, {'TEST000': 40, 'TEST001': 50, 'TEST002': 60, 'TEST003': None})
+
 
 class TotalIncomeByInterval(TotalIncome):
 
@@ -395,6 +663,16 @@ class TotalIncomeByInterval(TotalIncome):
 
         self.assertEqual(response.data, {'2021-10-04_2021-10-17': 0, '2021-09-20_2021-10-03': 0})
 
+    def test_total_income_by_interval_query_count(self):
+        self.create_models()
+        for i in range(5):
+            Interval.objects.create(start_date=date(2021, 10, 18) + timedelta(14 * i),
+                                    end_date=date(2021, 10, 31) + timedelta(14 * i))
+        with self.assertNumQueries(3):
+            response = client.get('/api/metrics/total-income-by-interval', follow=True)
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual(response.data['2021-09-20_2021-10-03'], 2600)
+
 
 class TotalPaymentByInterval(TotalPaid):
     def test_total_payment_by_interval(self):
@@ -410,6 +688,151 @@ class TotalPaymentByInterval(TotalPaid):
 
         self.assertEqual(response.data, {'2021-09-06_2021-09-19': 0, '2022-01-24_2021-09-19': 0})
 
+    def test_total_payment_by_interval_query_count(self):
+        self.create_models()
+        with self.assertNumQueries(3):
+            client.get('/api/metrics/total-payment-by-interval', follow=True)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        User.objects.create(id='TEST000', name='Test0')
+        self.interval = Interval.objects.create(start_date='2021-10-04', end_date='2021-10-17')
+
+    def assert_not_modified(self, url, queries=1):
+        etag = client.get(url)['ETag']
+        with self.assertNumQueries(queries):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        return etag
+
+    def test_intervals_etag(self):
+        etag = self.assert_not_modified('/api/intervals/')
+        client.patch('/api/interval/' + str(self.interval.id) + '/amount/', json.dumps({'amount': 1000}),
+                     content_type='application/json')
+        response = client.get('/api/intervals/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['amount'], 1000)
+
+    def test_payment_etag(self):
+        url = '/api/payment/' + str(self.interval.id) + '/'
+        etag = self.assert_not_modified(url)
+        client.post('/api/payment/', json.dumps({'interval': self.interval.id, 'user': 'TEST000', 'amount': 5}),
+                    content_type='application/json')
+        self.assertNotEqual(client.get(url)['ETag'], etag)
+
+        etag = self.assert_not_modified(url)
+        submit_income_as_payment(self.interval.id, {})
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).data, {})
+
+        # Payments deleted one by one or as a queryset bump the version
+        for delete in [lambda: Payment.objects.get().delete(), lambda: Payment.objects.all().delete()]:
+            Payment.objects.create(interval=self.interval, user_id='TEST000', amount=5)
+            etag = self.assert_not_modified(url)
+            delete()
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).data, {})
+
+        Payment.objects.create(interval=self.interval, user_id='TEST000', amount=5)
+        etag = self.assert_not_modified(url)
+        self.interval.delete()
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).data, {})
+
+    def test_numerical_params_etag(self):
+        etag = self.assert_not_modified('/api/numerical-params/')
+        client.patch('/api/numerical-params/', json.dumps({'key': 'intervals_per_period', 'value': 3}),
+                     content_type='application/json')
+        self.assertEqual(client.get('/api/numerical-params/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_200_OK)
+
+    def test_metrics_etag(self):
+        source = IncomeSource.objects.create(name='TestIncomeSource', user_id='TEST000')
+        for url in ['/api/metrics/total-income', '/api/metrics/total-income-by-interval']:
+            etag = self.assert_not_modified(url)
+            Income.objects.create(incomesource=source, amount=10, date='2021-10-05')
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        for url in ['/api/metrics/total-paid', '/api/metrics/total-payment-by-interval']:
+            etag = self.assert_not_modified(url)
+            Payment.objects.create(interval=self.interval, user_id='TEST000', amount=1 + Payment.objects.count())
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+            Payment.objects.all().delete()
+
+
+class ServerMetricsTest(TestCase):
+    def setUp(self):
+        request_metrics.reset()
+        self.admin = Client()
+        self.admin.force_login(AuthUser.objects.create(username='admin', is_staff=True))
+
+    def test_server_metrics(self):
+        User.objects.create(id='TEST000', name='Test0')
+        users_response = client.get('/api/users/')
+        client.get('/api/users/')
+        client.get('/api/no-such-route/')
+
+        response = self.admin.get('/api/metrics/server')
+        routes = {(r['route'], r['method']): r for r in response.json()['routes']}
+        users = routes[('api/users/', 'GET')]
+        self.assertEqual(users['count'], 2)
+        self.assertEqual(users['statuses'], {'2xx': 2})
+        self.assertEqual(users['sql']['queries'], 2)
+        self.assertEqual(users['response_bytes']['total'], 2 * len(users_response.content))
+        self.assertEqual(sum(users['latency_ms']['buckets'].values()), 2)
+        self.assertEqual(routes[('<unmatched>', 'GET')]['statuses'], {'4xx': 1})
+
+    def test_server_metrics_prometheus(self):
+        client.get('/api/users/')
+        response = self.admin.get('/api/metrics/server?format=prometheus')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertIn('api_request_duration_seconds_bucket{route="api/users/",method="GET",le="+Inf"} 1', lines)
+        self.assertIn('api_sql_queries_total{route="api/users/",method="GET"} 1', lines)
+        self.assertIn('api_responses_total{route="api/users/",method="GET",status="2xx"} 1', lines)
+
+    def test_server_metrics_bad_format(self):
+        self.assertEqual(self.admin.get('/api/metrics/server?format=xml').status_code, 400)
+
+    def test_server_metrics_requires_admin_or_token(self):
+        self.assertEqual(client.get('/api/metrics/server').status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(client.get('/api/metrics/server', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(client.get('/api/metrics/server', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_server_metrics_unknown_method(self):
+        client.generic('BREW', '/api/users/')
+        routes = {(r['route'], r['method']) for r in self.admin.get('/api/metrics/server').json()['routes']}
+        self.assertIn(('api/users/', 'OTHER'), routes)
+
+
+# Export
+
+
+class ExportTest(TotalIncome):
+    def read(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_incomes_csv(self):
+        self.create_models()
+        response = client.get('/api/export/incomes?from=2021-09-24&to=2021-09-25&user=TEST002')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        interval = Interval.objects.get(start_date='2021-09-20')
+        income_id = Income.objects.get(amount=700).id
+        self.assertEqual(self.read(response).splitlines(), [
+            'id,user,income_source,amount,date,interval',
+            '%d,TEST002,TestIncomeSource,700,2021-09-25,%d' % (income_id, interval.id)])
+
+    def test_export_payments_ndjson(self):
+        self.create_models()
+        interval = Interval.objects.get(start_date='2021-10-04')
+        payment = Payment.objects.create(user_id='TEST001', interval=interval, amount=12)
+        response = client.get('/api/export/payments?format=ndjson')
+        self.assertEqual([json.loads(line) for line in self.read(response).splitlines()], [
+            {'id': payment.id, 'user': 'TEST001', 'interval': interval.id, 'start_date': '2021-10-04',
+             'end_date': '2021-10-17', 'amount': 12}])
+
+    def test_export_bad_format(self):
+        self.assertEqual(client.get('/api/export/incomes?format=xml').status_code, 400)
+        self.assertEqual(client.get('/api/export/payments?to=soon').status_code, 400)
+
 
 # DELETE
 
@@ -456,7 +879,8 @@ class NumericalParamsTest(TestCase):
     def test_get_numerical_params(self):
         self.create_models()
         response = client.get('/api/numerical-params/', follow=True)
-        self.assertEqual(response.data, {'default_interval_amount': 1234, 'hello': 1111})
+        # intervals_per_period is created by the migrations
+        self.assertEqual(response.data, {'default_interval_amount': 1234, 'hello': 1111, 'intervals_per_period': 2})
 
     def test_patch_numerical_params(self):
         target_key = self.create_models()
@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# Read only routes are served by async views when the app runs over ASGI, see Backend/asgi.py
+read_views = async_views if settings.ASYNC_VIEWS else views
+interval_list = async_views.interval_list if settings.ASYNC_VIEWS else views.IntervalLatestListView.as_view()
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -10,25 +15,34 @@ urlpatterns = [
 
     # POST
     path('income/', views.IncomeView.as_view()),
+    path('income/batch/', views.IncomeBatchView.as_view()),
     path('payment/', views.PaymentView.as_view()),
+    path('tax/simulate/', views.simulate_tax),
+    path('tax/recompute/', views.recompute_payments),
 
 
     # GET
-    path('intervals/', views.IntervalLatestListView.as_view()),
+    path('intervals/', interval_list),
     path('users/', views.UserListView.as_view()),
     path('income-sources/<str:user>/', views.UserIncomeSourceListView.as_view()),
 
     # Specified by interval
-    path('payment/<str:interval>/', views.payment),
+    path('payment/<str:interval>/', read_views.payment),
     path('tax/<str:interval>/', views.tax),
-    path('income/income-source/<str:interval>/', views.income_per_interval),
-    path('income/averaged/<str:interval>', views.avg_income_per_interval),
-    path('users/unsubmitted/<str:interval>', views.unsubmitted_users_per_interval),
+    path('income/income-source/<str:interval>/', read_views.income_per_interval),
+    path('income/averaged/<str:interval>', read_views.avg_income_per_interval),
+    path('users/unsubmitted/<str:interval>', read_views.unsubmitted_users_per_interval),
+    path('interval/<str:interval>/dashboard', read_views.interval_dashboard),
     # Metrics
-    path('metrics/total-income', views.total_income),
-    path('metrics/total-paid', views.total_paid),
-    path('metrics/total-income-by-interval', views.total_income_by_interval),
-    path('metrics/total-payment-by-interval', views.total_payment_by_interval),
+    path('metrics/total-income', read_views.total_income),
+    path('metrics/total-paid', read_views.total_paid),
+    path('metrics/total-income-by-interval', read_views.total_income_by_interval),
+    path('metrics/total-payment-by-interval', read_views.total_payment_by_interval),
+    path('metrics/server', views.server_metrics),
+
+    # Export
+    path('export/incomes', views.export_incomes),
+    path('export/payments', views.export_payments),
 
     # DELETE
     path('income/<str:income>', views.delete_specific_income),
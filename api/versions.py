@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models import F
+
+from api.models import DataVersion
+
+'''
+Monotonic counters bumped whenever the data behind a key changes, so cached results can be keyed by them.
+Keys: 'income:<interval id>' and 'income:all' for the incomes of an interval, and one key per table:
+'incomes', 'payments', 'intervals', 'numerical_params' and 'users'.
+'''
+
+
+def bump_versions(*keys):
+    if not keys:
+        return
+    with transaction.atomic():
+        DataVersion.objects.bulk_create([DataVersion(key=key) for key in set(keys)], ignore_conflicts=True)
+        DataVersion.objects.filter(key__in=keys).update(value=F('value') + 1)
+
+
+def get_versions(keys):
+    versions = dict(DataVersion.objects.filter(key__in=keys).values_list('key', 'value'))
+    return [versions.get(key, 0) for key in keys]
+
+
+def income_version_key(interval_id):
+    return 'income:' + str(interval_id)
+
+
+def versions_etag(*keys):
+    """ Builds an etag_func for django.views.decorators.http.condition from the versions of keys """
+    def etag_func(request, *args, **kwargs):
+        return '-'.join(str(value) for value in get_versions(keys))
+    return etag_func
@@ -1,24 +1,47 @@
-import math
-from datetime import date, timedelta
+import csv
+from datetime import date
+from itertools import chain
 import json
-
-from django.http import HttpResponse
-from django.db.models import F, Sum
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 
 from api.models import User, IncomeSource, Income, Payment, Interval, NumericalParams
-from api.helpers import get_average_incomes, get_tax_dict, has_all_income_submitted, get_income_unsubmitted_users, submit_income_as_payment
+from api.helpers import (
+    DEGREE_POLY, get_average_incomes, get_average_window, get_intervals_per_period, get_tax_result, get_tax_version,
+    get_income_unsubmitted_users, get_income_per_source, get_income_by_interval, get_payment_by_interval,
+    get_user_income_totals, get_user_payment_totals, recompute_all_payments
+)
+from api.middleware import request_metrics
+from api.rollup import add_incomes
+from api.routers import replica_reads
+from api.taxengine import simulate_taxes
+from api.versions import versions_etag
 from api.serializers import (
     UserSerializer, UserIncomeSourceSerializer, IncomeSerializer,
     PaymentSerializer, IntervalSerializer
 )
 # pylint: disable=unused-argument,no-self-use
 
-DAYS_IN_INTERVAL = 14
+MAX_TAX_SCENARIOS = 1000
+# Keeps incomes raised to the degree + 1 within floats and the amounts within the int64 the tax engine uses
+MAX_TAX_DEGREE = 10
+MAX_TAX_AMOUNT = 2 ** 53
+DEFAULT_INTERVAL_PAGE_SIZE = 20
+MAX_INTERVAL_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
 
 # Create your views here.
 
@@ -46,34 +69,140 @@ class IncomeView(generics.CreateAPIView):
     serializer_class = IncomeSerializer
 
 
+class IncomeBatchView(APIView):
+    """ POST a list of incomes, created together once all of them are valid """
+
+    def post(self, request):
+        serializer = IncomeSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Ids are only returned by backends that support returning them from bulk inserts
+        incomes = add_incomes([Income(**row) for row in serializer.validated_data])
+        return Response([{'id': inc.id, **row} for inc, row in zip(incomes, IncomeSerializer(incomes, many=True).data)],
+                        status=status.HTTP_201_CREATED)
+
+
 class PaymentView(generics.CreateAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
 
 
+def is_integer(value):
+    # JSON true and false are parsed as bools, which are ints in Python
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def simulate_tax(request):
+    """ POST amounts and polynomial degrees to tax every interval under each combination of them """
+    if not isinstance(request.data, dict):
+        return Response({'message': 'The body must be an object.'}, status=status.HTTP_400_BAD_REQUEST)
+    amounts = request.data.get('amounts', [None])
+    degrees = request.data.get('degrees', [DEGREE_POLY])
+    interval_ids = request.data.get('intervals', None)
+
+    if not isinstance(amounts, list) or not all(a is None or is_integer(a) and abs(a) <= MAX_TAX_AMOUNT
+                                                for a in amounts):
+        return Response({'message': 'Amounts must be a list of integers of at most ' + str(MAX_TAX_AMOUNT) + '.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(degrees, list) or not all(is_integer(d) and 0 <= d <= MAX_TAX_DEGREE for d in degrees):
+        return Response({'message': 'Degrees must be a list of integers from 0 to ' + str(MAX_TAX_DEGREE) + '.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if interval_ids is not None and not (isinstance(interval_ids, list) and all(map(is_integer, interval_ids))):
+        return Response({'message': 'Intervals must be a list of ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(amounts) * len(degrees) > MAX_TAX_SCENARIOS:
+        return Response({'message': 'At most ' + str(MAX_TAX_SCENARIOS) + ' scenarios can be simulated.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(simulate_taxes(amounts, degrees, interval_ids))
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def recompute_payments(request):
+    """ POST to recompute the tax payments of every interval """
+    start = time.perf_counter()
+    stats = recompute_all_payments()
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return Response(stats)
+
+
 # GET
 
 
+def get_interval_cursor(i_o):
+    return str(i_o.end_date) + '_' + str(i_o.id)
+
+
+def parse_interval_cursor(cursor):
+    """ Reads an (end_date, id) cursor made by get_interval_cursor, raising ValueError when malformed """
+    end_date, interval_id = cursor.split('_')
+    return date.fromisoformat(end_date), int(interval_id)
+
+
+def list_intervals(params):
+    """
+    Intervals latest first, optionally within `from` and `to`. With `limit`, `after` or `before` a page is returned
+    with the cursors of the pages after it (older intervals) and before it (newer intervals), seeking on
+    (end_date, id). Raises ValueError with a message for the client when a parameter is malformed.
+    """
+    try:
+        from_date, to_date = parse_date_range(params)
+    except ValueError as e:
+        raise ValueError('Dates must be formatted as YYYY-MM-DD.') from e
+
+    intervals = Interval.objects.all()
+    if from_date is not None:
+        intervals = intervals.filter(start_date__gte=from_date)
+    if to_date is not None:
+        intervals = intervals.filter(end_date__lte=to_date)
+
+    if not {'limit', 'after', 'before'} & set(params):
+        return IntervalSerializer(intervals.order_by('-end_date'), many=True).data
+
+    try:
+        limit = int(params.get('limit', DEFAULT_INTERVAL_PAGE_SIZE))
+        after = parse_interval_cursor(params['after']) if 'after' in params else None
+        before = parse_interval_cursor(params['before']) if 'before' in params else None
+    except ValueError as e:
+        raise ValueError('Limit must be an integer and cursors as returned in next or previous.') from e
+    if not 0 < limit <= MAX_INTERVAL_PAGE_SIZE:
+        raise ValueError('Limit must be between 1 and ' + str(MAX_INTERVAL_PAGE_SIZE) + '.')
+    if after is not None and before is not None:
+        raise ValueError('Only one of after and before can be given.')
+
+    # One more row than the page is read to know whether the page has a neighbour past it
+    if before is None:
+        if after is not None:
+            intervals = intervals.filter(Q(end_date__lt=after[0]) | Q(end_date=after[0], id__lt=after[1]))
+        page = list(intervals.order_by('-end_date', '-id')[:limit + 1])
+        has_next, has_previous = len(page) > limit, after is not None
+        page = page[:limit]
+    else:
+        intervals = intervals.filter(Q(end_date__gt=before[0]) | Q(end_date=before[0], id__gt=before[1]))
+        page = list(intervals.order_by('end_date', 'id')[:limit + 1])
+        has_next, has_previous = True, len(page) > limit
+        page = page[:limit][::-1]
+
+    return {
+        'results': IntervalSerializer(page, many=True).data,
+        'next': get_interval_cursor(page[-1]) if page and has_next else None,
+        'previous': get_interval_cursor(page[0]) if page and has_previous else None,
+    }
+
+
+@replica_reads
 class IntervalLatestListView(APIView):
-    def add_latest_intervals(self, c_d, l_i):
-        d_d = c_d - l_i.end_date
-        i_to_add = math.ceil(d_d.days / DAYS_IN_INTERVAL)
-        default_interval_amount = NumericalParams.objects.get(pk='default_interval_amount').value
-        for _ in range(i_to_add):
-            i_l = Interval.objects.all().order_by('-end_date').first()
-            n_sd = i_l.end_date + timedelta(days=1)
-            n_ed = n_sd + timedelta(days=DAYS_IN_INTERVAL - 1)
-            Interval.objects.create(start_date=n_sd, end_date=n_ed, amount=default_interval_amount)
+    """ GET intervals, see list_intervals. New intervals are created by the create_intervals command """
 
+    @method_decorator(condition(etag_func=versions_etag('intervals')))
     def get(self, request):
-        l_i = Interval.objects.all().order_by('-end_date').first()
-        # Check if the current date is inside the latest interval
-        c_d = date.today()
-        if c_d > l_i.end_date:
-            self.add_latest_intervals(c_d, l_i)
-        intervals = Interval.objects.all().order_by('-end_date')
-        serializer = IntervalSerializer(intervals, many=True)
-        return Response(serializer.data)
+        try:
+            return Response(list_intervals(request.GET))
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class UserListView(generics.ListAPIView):
@@ -90,12 +219,14 @@ class UserIncomeSourceListView(APIView):
 
 # Specified by interval
 
+@replica_reads
+@condition(etag_func=versions_etag('payments'))
 @api_view(['GET'])
 def payment(request, interval):
     payment_dict = {}
-    payments = Payment.objects.filter(interval_id=interval)
-    for payment in payments:
-        payment_dict[payment.user.id] = payment.amount
+    payments = Payment.objects.filter(interval_id=interval).values_list('user_id', 'amount')
+    for user_id, amount in payments:
+        payment_dict[user_id] = amount
 
     return Response(payment_dict)
 
@@ -103,34 +234,21 @@ def payment(request, interval):
 @api_view(['GET'])
 def tax(request, interval):
     """ GET the tax due for a specific interval """
-    if not has_all_income_submitted(interval):
-        submit_income_as_payment(interval, {}, all_income_submitted=False)
+    all_income_submitted, tax_dict = get_tax_result(get_object_or_404(Interval, pk=interval))
+    if not all_income_submitted:
         return Response({}, status=status.HTTP_403_FORBIDDEN)
 
-    tax_dict = get_tax_dict(interval)
-    submit_income_as_payment(interval, tax_dict)
-
     return Response(tax_dict)
 
 
+@replica_reads
 @api_view(['GET'])
 def income_per_interval(request, interval):
     i_t = Interval.objects.get(id=interval)
-    return_dict = {}
-    for user in User.objects.all():
-        incomesources = IncomeSource.objects.filter(user=user)
-        user_source = {}
-        for inc_source in incomesources:
-            incomes = Income.objects.filter(date__gte=i_t.start_date, date__lte=i_t.end_date, incomesource=inc_source)
-            if len(incomes) > 0:
-                amount = sum([i.amount for i in incomes])
-                inc_ids = [i.id for i in incomes]
-                user_source[inc_source.name] = {'amount': amount, 'ids': inc_ids}
-        if len(user_source) > 0:
-            return_dict[user.id] = user_source
-    return Response(return_dict)
+    return Response(get_income_per_source(i_t))
 
 
+@replica_reads
 @api_view(['GET'])
 def avg_income_per_interval(request, interval):
     avg_incs = get_average_incomes(interval)
@@ -140,55 +258,188 @@ def avg_income_per_interval(request, interval):
     return Response(ret_dict)
 
 
+@replica_reads
 @api_view(['GET'])
 def unsubmitted_users_per_interval(request, interval):
-    unsubmitted, _ = get_income_unsubmitted_users(interval)
+    unsubmitted = get_income_unsubmitted_users(interval)
     unsubmitted_arr = sorted(unsubmitted)
     return Response(unsubmitted_arr)
 
 
+def build_dashboard(c_i, intervals_per_period, window, version, income_per_source, user_ids, avg_incs=None):
+    """ Derives the dashboard of an interval from its incomes per source and user ids, loaded after its tax version """
+    if avg_incs is None:
+        avg_incs = get_average_incomes(c_i.id, intervals_per_period, window)
+    unsubmitted = set(user_ids) - set(income_per_source)
+
+    # Computing the tax can submit payments, so they are read after it
+    all_income_submitted, tax_dict = get_tax_result(c_i, intervals_per_period, window, avg_incs, unsubmitted, version)
+    payments = dict(Payment.objects.filter(interval=c_i).values_list('user_id', 'amount'))
+
+    return {
+        'interval': IntervalSerializer(c_i).data,
+        'all_income_submitted': all_income_submitted,
+        'tax': tax_dict,
+        'payment': payments,
+        'income_per_source': income_per_source,
+        'averaged_income': {inc['user']: inc['amount'] for inc in avg_incs},
+        'unsubmitted_users': sorted(unsubmitted),
+    }
+
+
+@api_view(['GET'])
+def interval_dashboard(request, interval):
+    """
+    GET everything shown for an interval: the payloads of the tax, payment, income per source, averaged income and
+    unsubmitted users routes, derived from one load of the interval, its incomes and its averaging window.
+    """
+    c_i = get_object_or_404(Interval, pk=interval)
+    intervals_per_period = get_intervals_per_period()
+    window = get_average_window(c_i, intervals_per_period)
+    # The tax result is stored under the version read before the incomes and users it is computed from
+    version = get_tax_version(c_i, window[:intervals_per_period])
+    return Response(build_dashboard(c_i, intervals_per_period, window, version, get_income_per_source(c_i),
+                                    User.objects.values_list('id', flat=True)))
+
+
+def parse_date_range(params):
+    """ Reads the optional `from` and `to` ISO dates of query params, raising ValueError when malformed """
+    from_date, to_date = params.get('from'), params.get('to')
+    return (date.fromisoformat(from_date) if from_date else None,
+            date.fromisoformat(to_date) if to_date else None)
+
+
+@replica_reads
+@condition(etag_func=versions_etag('incomes', 'users'))
 @api_view(['GET'])
 def total_income(request):
-    return_dict = {}
-    for user in User.objects.all():
-        return_dict[user.id] = Income.objects.filter(incomesource__user__id=user.id).aggregate(Sum('amount'))['amount__sum']
-    return Response(return_dict)
+    try:
+        from_date, to_date = parse_date_range(request.query_params)
+    except ValueError:
+        return Response({'message': 'Dates must be formatted as YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(get_user_income_totals(from_date, to_date))
 
 
+@replica_reads
+@condition(etag_func=versions_etag('payments', 'users'))
 @api_view(['GET'])
 def total_paid(request):
-    return_dict = {}
-    for user in User.objects.all():
-        return_dict[user.id] = Payment.objects.filter(user__id=user.id).aggregate(Sum('amount'))['amount__sum']
-    return Response(return_dict)
+    try:
+        from_date, to_date = parse_date_range(request.query_params)
+    except ValueError:
+        return Response({'message': 'Dates must be formatted as YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(get_user_payment_totals(from_date, to_date))
+
 
+def get_interval_totals(intervals, totals):
+    """ Totals keyed by <start date>_<end date>, 0 for intervals missing from totals """
+    return {str(i_o.start_date) + '_' + str(i_o.end_date): totals.get(i_o.id, 0) for i_o in intervals}
 
+
+@replica_reads
+@condition(etag_func=versions_etag('incomes', 'intervals'))
 @api_view(['GET'])
 def total_income_by_interval(request):
-    return_dict, all_intervals = {}, Interval.objects.all()
-    for i_o in all_intervals:
-        sd, ed = i_o.start_date, i_o.end_date
-        key = str(sd) + '_' + str(ed)
-        income = Income.objects.filter(date__gte=sd, date__lte=ed, ).aggregate(Sum('amount'))['amount__sum']
-        if income is None:
-            income = 0
-        return_dict[key] = income
-
-    return Response(return_dict)
+    all_intervals = list(Interval.objects.all())
+    return Response(get_interval_totals(all_intervals, get_income_by_interval(all_intervals)))
 
 
+@replica_reads
+@condition(etag_func=versions_etag('payments', 'intervals'))
 @api_view(['GET'])
 def total_payment_by_interval(request):
-    return_dict, all_intervals = {}, Interval.objects.all()
-    for i_o in all_intervals:
-        sd, ed = i_o.start_date, i_o.end_date
-        key = str(sd) + '_' + str(ed)
-        payment = Payment.objects.filter(interval__id=i_o.id).aggregate(Sum('amount'))['amount__sum']
-        if payment is None:
-            payment = 0
-        return_dict[key] = payment
+    all_intervals = list(Interval.objects.all())
+    return Response(get_interval_totals(all_intervals, get_payment_by_interval(all_intervals)))
+
+
+def can_read_server_metrics(request):
+    if request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token)
+
+
+@require_GET
+def server_metrics(request):
+    """ GET the request statistics of this server process as JSON or, with ?format=prometheus, Prometheus text """
+    if not can_read_server_metrics(request):
+        return JsonResponse({'detail': 'You do not have permission to perform this action.'},
+                            status=status.HTTP_403_FORBIDDEN)
+    metrics_format = request.GET.get('format', 'json')
+    if metrics_format == 'prometheus':
+        return HttpResponse(request_metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    if metrics_format != 'json':
+        return JsonResponse({'message': 'Format must be json or prometheus.'}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse(request_metrics.snapshot())
+
+
+# Export
+
+
+class Echo:
+    """ File-like object handing back what is written, so csv.writer can feed a streaming response """
+
+    def write(self, value):
+        return value
+
 
-    return Response(return_dict)
+def export_response(request, queryset, columns):
+    """ Streams a queryset as CSV or, with ?format=ndjson, as one JSON object per line """
+    export_format = request.GET.get('format', 'csv')
+    rows = queryset.values_list(*[field for field, _ in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    names = [name for _, name in columns]
+
+    if export_format == 'ndjson':
+        lines = (json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    if export_format != 'csv':
+        return JsonResponse({'message': 'Format must be csv or ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    writer = csv.writer(Echo())
+    lines = chain([writer.writerow(names)], (writer.writerow(row) for row in rows))
+    return StreamingHttpResponse(lines, content_type='text/csv')
+
+
+@require_GET
+def export_incomes(request):
+    """ GET incomes, optionally filtered by `from`, `to` and `user` """
+    try:
+        from_date, to_date = parse_date_range(request.GET)
+    except ValueError:
+        return JsonResponse({'message': 'Dates must be formatted as YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    incomes = Income.objects.order_by('date', 'id')
+    if from_date is not None:
+        incomes = incomes.filter(date__gte=from_date)
+    if to_date is not None:
+        incomes = incomes.filter(date__lte=to_date)
+    if request.GET.get('user'):
+        incomes = incomes.filter(incomesource__user=request.GET['user'])
+
+    return export_response(request, incomes, [
+        ('id', 'id'), ('incomesource__user', 'user'), ('incomesource__name', 'income_source'),
+        ('amount', 'amount'), ('date', 'date'), ('interval', 'interval')])
+
+
+@require_GET
+def export_payments(request):
+    """ GET payments, optionally filtered by `user` and by `from` and `to` against their interval dates """
+    try:
+        from_date, to_date = parse_date_range(request.GET)
+    except ValueError:
+        return JsonResponse({'message': 'Dates must be formatted as YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    payments = Payment.objects.order_by('interval__start_date', 'id')
+    if from_date is not None:
+        payments = payments.filter(interval__start_date__gte=from_date)
+    if to_date is not None:
+        payments = payments.filter(interval__end_date__lte=to_date)
+    if request.GET.get('user'):
+        payments = payments.filter(user=request.GET['user'])
+
+    return export_response(request, payments, [
+        ('id', 'id'), ('user', 'user'), ('interval', 'interval'), ('interval__start_date', 'start_date'),
+        ('interval__end_date', 'end_date'), ('amount', 'amount')])
 
 
 # DELETE
@@ -200,6 +451,7 @@ def delete_specific_income(request, income):
     return Response({'message': 'Delete income' + str(income)}, status=status.HTTP_204_NO_CONTENT)
 
 
+@condition(etag_func=versions_etag('numerical_params'))
 @api_view(['GET', 'PATCH'])
 def numerical_params(request):
     if request.method == 'GET':
@@ -219,6 +471,10 @@ def numerical_params(request):
         if not isinstance(value, int):
             return Response({'message': 'Value is not an integer.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if key == 'intervals_per_period' and value < 1:
+            return Response({'message': 'intervals_per_period must be at least 1.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
         try:
             param = NumericalParams.objects.get(pk=key)
         except NumericalParams.DoesNotExist: